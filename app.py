@@ -3,14 +3,19 @@ Basketball Object Detection Web Application
 DDS70 Project - Flask Backend
 """
 
-from ultralytics import YOLO
 from flask import Flask, request, Response, jsonify, send_from_directory
 from waitress import serve
 from PIL import Image
 import json
 import os
+import sys
 import logging
 
+# Shared inference core lives in webapp/; appended so this directory's own
+# modules (app, demo) still win over webapp/app.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "webapp"))
+from inference import Detector
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -21,20 +26,13 @@ app = Flask(__name__)
 model = None
 
 def load_model():
-    """Load the YOLO model with error handling"""
+    """Load the custom model, falling back to pre-trained YOLOv8n, with error handling"""
     global model
     try:
-        # Try to load custom trained model first
-        model_path = "trainon10kdataset/weights/best.pt"
-        if os.path.exists(model_path):
-            model = YOLO(model_path)
-            logger.info(f"Loaded custom model from {model_path}")
-            return True
-        else:
-            # Fallback to pre-trained model
-            model = YOLO("yolov8n.pt")
-            logger.info("Loaded pre-trained YOLOv8n model")
-            return True
+        # Tiled inference is a webapp/API feature; keep /detect at one forward pass per image
+        model = Detector.load(tiled="off")
+        logger.info(f"Loaded model from {model.weights_path}")
+        return True
     except Exception as e:
         logger.error(f"Error loading model: {e}")
         return False
@@ -88,20 +86,7 @@ def detect_objects_on_image(image):
     and their bounding boxes
     """
     try:
-        results = model.predict(image, conf=0.25)  # Lower confidence threshold
-        result = results[0]
-        output = []
-        
-        for box in result.boxes:
-            x1, y1, x2, y2 = [
-                round(x) for x in box.xyxy[0].tolist()
-            ]
-            class_id = box.cls[0].item()
-            prob = round(box.conf[0].item(), 2)
-            
-            output.append([
-                x1, y1, x2, y2, result.names[class_id], prob
-            ])
+        output = model.predict(image, conf=0.25).to_lists()  # Lower confidence threshold
         
         logger.info(f"Detected {len(output)} objects")
         return output
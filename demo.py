@@ -8,35 +8,26 @@ using your webcam. Perfect for interviews and demonstrations.
 
 import cv2
 import math
-from ultralytics import YOLO
 import os
 import sys
 
+# Shared inference core lives in webapp/; appended so this directory's own
+# modules (app, demo) still win over webapp/app.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "webapp"))
+from inference import Detector, find_weights
+
 def load_model():
-    """Load the best available model"""
+    """Load the best available model; class names come from the weights"""
     # Try custom model first
-    custom_model_path = "trainon10kdataset/weights/best.pt"
-    if os.path.exists(custom_model_path):
+    custom_model_path = find_weights()
+    if custom_model_path:
         print(f"🎯 Loading custom basketball model: {custom_model_path}")
-        model = YOLO(custom_model_path)
-        class_names = ["Basketball-court", "ball", "made", "person", "rim", "shoot"]
-        print(f"📊 Custom model classes: {class_names}")
-        return model, class_names
     else:
         print("🔄 Custom model not found, using pre-trained YOLOv8n")
-        model = YOLO("yolov8n.pt")
-        class_names = ["person", "bicycle", "car", "motorbike", "aeroplane", "bus", "train", "truck", "boat",
-                      "traffic light", "fire hydrant", "stop sign", "parking meter", "bench", "bird", "cat",
-                      "dog", "horse", "sheep", "cow", "elephant", "bear", "zebra", "giraffe", "backpack", "umbrella",
-                      "handbag", "tie", "suitcase", "frisbee", "skis", "snowboard", "sports ball", "kite", "baseball bat",
-                      "baseball glove", "skateboard", "surfboard", "tennis racket", "bottle", "wine glass", "cup",
-                      "fork", "knife", "spoon", "bowl", "banana", "apple", "sandwich", "orange", "broccoli",
-                      "carrot", "hot dog", "pizza", "donut", "cake", "chair", "sofa", "pottedplant", "bed",
-                      "diningtable", "toilet", "tvmonitor", "laptop", "mouse", "remote", "keyboard", "cell phone",
-                      "microwave", "oven", "toaster", "sink", "refrigerator", "book", "clock", "vase", "scissors",
-                      "teddy bear", "hair drier", "toothbrush"]
-        print(f"📊 Pre-trained model loaded with {len(class_names)} classes")
-        return model, class_names
+    
+    detector = Detector.load(custom_model_path)
+    print(f"📊 Model loaded with {len(detector.names)} classes: {list(detector.names.values())}")
+    return detector
 
 def run_demo():
     """Run the real-time detection demo"""
@@ -45,7 +36,7 @@ def run_demo():
     
     # Load model
     try:
-        model, class_names = load_model()
+        detector = load_model()
     except Exception as e:
         print(f"❌ Error loading model: {e}")
         return False
@@ -83,52 +74,44 @@ def run_demo():
             frame_count += 1
             
             # Run detection
-            results = model(img, stream=True, conf=0.3, verbose=False)
+            detections = detector.predict(img, conf=0.3)
             
             # Process results
-            for r in results:
-                boxes = r.boxes
+            for x1, y1, x2, y2, class_name, confidence in detections:
+                # Get bounding box coordinates
+                x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
+                
+                # Get confidence
+                confidence = math.ceil(confidence * 100) / 100
+                
+                # Choose color based on confidence
+                if confidence > 0.7:
+                    color = (0, 255, 0)  # Green for high confidence
+                elif confidence > 0.5:
+                    color = (0, 255, 255)  # Yellow for medium confidence
+                else:
+                    color = (0, 0, 255)  # Red for low confidence
+                
+                # Draw bounding box
+                cv2.rectangle(img, (x1, y1), (x2, y2), color, 2)
+                
+                # Create label
+                label = f"{class_name}: {confidence:.2f}"
+                
+                # Get text size for background
+                (text_width, text_height), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
+                
+                # Draw background for text
+                cv2.rectangle(img, (x1, y1 - text_height - 10), (x1 + text_width, y1), color, -1)
                 
-                for box in boxes:
-                    # Get bounding box coordinates
-                    x1, y1, x2, y2 = box.xyxy[0]
-                    x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
-                    
-                    # Get confidence and class
-                    confidence = math.ceil((box.conf[0] * 100)) / 100
-                    cls = int(box.cls[0])
-                    
-                    if cls < len(class_names):
-                        class_name = class_names[cls]
-                        
-                        # Choose color based on confidence
-                        if confidence > 0.7:
-                            color = (0, 255, 0)  # Green for high confidence
-                        elif confidence > 0.5:
-                            color = (0, 255, 255)  # Yellow for medium confidence
-                        else:
-                            color = (0, 0, 255)  # Red for low confidence
-                        
-                        # Draw bounding box
-                        cv2.rectangle(img, (x1, y1), (x2, y2), color, 2)
-                        
-                        # Create label
-                        label = f"{class_name}: {confidence:.2f}"
-                        
-                        # Get text size for background
-                        (text_width, text_height), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
-                        
-                        # Draw background for text
-                        cv2.rectangle(img, (x1, y1 - text_height - 10), (x1 + text_width, y1), color, -1)
-                        
-                        # Draw text
-                        cv2.putText(img, label, (x1, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+                # Draw text
+                cv2.putText(img, label, (x1, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
             
             # Add info overlay
             if show_info:
                 info_text = [
                     f"Frame: {frame_count}",
-                    f"Model: {'Custom Basketball' if 'best.pt' in str(model.ckpt_path) else 'YOLOv8n'}",
+                    f"Model: {'Custom Basketball' if detector.is_custom else 'YOLOv8n'}",
                     "Press 'q' to quit, 's' to save, 'i' to toggle info"
                 ]
                 
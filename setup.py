@@ -129,6 +129,15 @@ def test_installation():
         print(f"❌ Test error: {e}")
         return False
 
+def read_training_performance(results_csv="trainon10kdataset/results.csv"):
+    """Read the best epoch's mAP50-95 from the training log, if present"""
+    # Same parser as the webapp's /api/model-info fallback
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "webapp"))
+    from evaluation import read_training_results
+    
+    best = read_training_results(results_csv)
+    return best["mAP50-95"] if best else None
+
 def show_usage_instructions():
     """Show how to use the project"""
     print("\n" + "="*60)
@@ -147,7 +156,11 @@ def show_usage_instructions():
     print("   Open any .ipynb file")
     
     print("\n📊 Model Performance:")
-    print("   - Custom model: 74.1% mAP50-95")
+    performance = read_training_performance()
+    if performance is not None:
+        print(f"   - Custom model: {performance * 100:.1f}% mAP50-95")
+    else:
+        print("   - Custom model: training results not found")
     print("   - Classes: Basketball courts, balls, players, rims, shots")
     
     print("\n💡 Tips for interviews:")
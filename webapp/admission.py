@@ -0,0 +1,138 @@
+"""
+Request Admission Control
+DDS70 Project - bounded concurrency, deadlines and load shedding for inference
+
+At most MAX_IN_FLIGHT inferences run at once and at most MAX_QUEUE requests
+wait for a slot. Beyond that requests are rejected immediately with a
+Retry-After hint instead of piling up and slowing everyone down. Every request
+carries a deadline; one that expires while queued (or cannot finish in time)
+is dropped before inference starts.
+
+The app serves one shared Detector, which runs a single inference at a time,
+so MAX_IN_FLIGHT defaults to 1; raising it only lets more requests wait on the
+model lock instead of in the admission queue.
+"""
+
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+MAX_IN_FLIGHT = int(os.environ.get("MAX_IN_FLIGHT", "1"))
+MAX_QUEUE = int(os.environ.get("MAX_QUEUE", "8"))
+REQUEST_TIMEOUT = float(os.environ.get("REQUEST_TIMEOUT", "30"))
+
+# Smoothing factor for the moving average of inference time
+SERVICE_TIME_ALPHA = 0.2
+
+
+class Overloaded(Exception):
+    """Queue is full; retry_after is a hint in whole seconds"""
+
+    def __init__(self, retry_after):
+        super().__init__("Server overloaded")
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """The request's deadline passed, or will pass, before inference could finish"""
+
+
+def deadline_from_headers(headers, default_timeout=REQUEST_TIMEOUT):
+    """
+    Absolute deadline (epoch seconds) for a request.
+    X-Request-Deadline gives it directly, X-Request-Timeout as seconds from now;
+    otherwise default_timeout applies. Clients can only shorten the default:
+    later deadlines are clamped to it, and non-finite values are ignored.
+    """
+    now = time.time()
+    latest = now + default_timeout
+    try:
+        if headers.get("X-Request-Deadline"):
+            deadline = float(headers["X-Request-Deadline"])
+        elif headers.get("X-Request-Timeout"):
+            deadline = now + float(headers["X-Request-Timeout"])
+        else:
+            return latest
+    except ValueError:
+        return latest
+
+    if not math.isfinite(deadline):
+        return latest
+    return min(deadline, latest)
+
+
+class AdmissionController:
+    """Bounded in-flight semaphore with a bounded wait queue"""
+
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT, max_queue=MAX_QUEUE):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.queued = 0
+        self.service_time = None
+        self.counters = {"admitted": 0, "rejected": 0, "expired": 0, "completed": 0}
+        self._cond = threading.Condition()
+
+    def retry_after(self):
+        """Seconds until a queue slot is likely to free up"""
+        service_time = self.service_time or 1.0
+        return max(1, math.ceil(service_time * (self.queued + 1) / self.max_in_flight))
+
+    @contextmanager
+    def admit(self, deadline):
+        """Hold an inference slot for the body of the with-block"""
+        with self._cond:
+            now = time.time()
+            remaining = deadline - now
+            if not math.isfinite(remaining):
+                # Condition.wait_for overflows on inf and never times out on nan
+                raise ValueError("deadline must be a finite epoch time")
+            # Drop work that is already late, or that the measured service time says cannot make it
+            if remaining <= 0 or (self.service_time is not None and remaining < self.service_time):
+                self.counters["expired"] += 1
+                raise DeadlineExceeded()
+
+            if self.in_flight >= self.max_in_flight and self.queued >= self.max_queue:
+                self.counters["rejected"] += 1
+                raise Overloaded(self.retry_after())
+
+            self.queued += 1
+            try:
+                admitted = self._cond.wait_for(lambda: self.in_flight < self.max_in_flight, timeout=remaining)
+            finally:
+                self.queued -= 1
+
+            if not admitted or time.time() >= deadline:
+                self.counters["expired"] += 1
+                self._cond.notify()
+                raise DeadlineExceeded()
+
+            self.in_flight += 1
+            self.counters["admitted"] += 1
+
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            with self._cond:
+                self.in_flight -= 1
+                self.counters["completed"] += 1
+                if self.service_time is None:
+                    self.service_time = elapsed
+                else:
+                    self.service_time += SERVICE_TIME_ALPHA * (elapsed - self.service_time)
+                self._cond.notify()
+
+    def status(self):
+        with self._cond:
+            return {
+                "in_flight": self.in_flight,
+                "queued": self.queued,
+                "max_in_flight": self.max_in_flight,
+                "max_queue": self.max_queue,
+                "avg_service_time": round(self.service_time, 3) if self.service_time is not None else None,
+                **self.counters,
+            }
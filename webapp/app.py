@@ -17,18 +17,42 @@ os.environ['MPLBACKEND'] = 'Agg'
 os.environ['LIBGL_ALWAYS_SOFTWARE'] = '1'
 os.environ['GALLIUM_DRIVER'] = 'softpipe'
 
-from flask import Flask, request, Response, jsonify, send_from_directory
+from flask import Flask, request, Response, jsonify, make_response, send_file, send_from_directory
 from flask_cors import CORS
 from PIL import Image
 import json
 import logging
 import time
 import random
+import re
+import hmac
+from functools import wraps
+
+from admission import AdmissionController, DeadlineExceeded, Overloaded, deadline_from_headers
+from detection_store import EVENT_KINDS, MAX_SESSION_SECONDS, SESSION_ID_PATTERN, DetectionStore, records_to_json
+from evaluation import model_metrics
+from inference import TILED_INFERENCE, Detector, find_weights
+from profiling import RequestProfiler
+from registry import ModelManager, ModelRegistry
+from runtime_tuning import RUNTIME_CALIBRATE, apply_runtime_tuning, calibrate, runtime_settings
+from shooting_stats import get_aggregator, list_aggregators
 
 # Try to import YOLO with proper error handling
 YOLO_AVAILABLE = False
 YOLO = None
 model = None
+model_path = None
+model_version = None
+model_manager = None
+registry = ModelRegistry()
+detection_store = DetectionStore()
+admission = AdmissionController()
+profiler = RequestProfiler()
+
+PROFILE_ID_PATTERN = re.compile(r"^\d+-[0-9a-f]{6}$")
+
+# Admin endpoints are disabled unless a token is configured
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
 
 def import_yolo():
     """Import YOLO only when needed to avoid startup failures"""
@@ -70,9 +94,19 @@ CORS(app, origins=[
     "https://*.up.railway.app"
 ])
 
+def _on_model_swap(version, new_model, path):
+    """Point the module-level model at a newly activated registry version"""
+    global model, model_path, model_version
+    if runtime_settings.get("channels_last"):
+        new_model.set_memory_format(channels_last=True)
+    model, model_path, model_version = new_model, path, version
+
 def load_model():
-    """Load the YOLO model with error handling"""
-    global model, YOLO_AVAILABLE
+    """Load the active registry version, registering the bundled weights on first run"""
+    global model_manager, YOLO_AVAILABLE
+    
+    # Size thread pools to the container before torch gets imported
+    apply_runtime_tuning()
     
     # Try to import YOLO first
     if not import_yolo():
@@ -80,37 +114,101 @@ def load_model():
         return True  # Return success for demo mode
     
     try:
-        # Try to load custom trained model first
-        # Handle both running from webapp/ and from root directory
-        model_paths = [
-            "trainon10kdataset/weights/best.pt",  # When run from webapp/
-            "../trainon10kdataset/weights/best.pt",  # When run from webapp/ but model is in parent
-            "webapp/trainon10kdataset/weights/best.pt"  # When run from root
-        ]
+        if registry.read().get("active") is None:
+            # Try to register custom trained model first
+            source_path = find_weights()
+            
+            if source_path:
+                logger.info(f"Registering custom basketball model from {source_path}")
+            else:
+                # Fallback to pre-trained model
+                source_path = Detector.load().weights_path
+                logger.info("Registering pre-trained YOLOv8n model")
+            
+            registry.set_active(registry.register(source_path))
         
-        model_path = None
-        for path in model_paths:
-            if os.path.exists(path):
-                model_path = path
-                break
+        model_manager = ModelManager(registry, Detector.load, on_swap=_on_model_swap)
+        model_manager.sync(background=False)
+        model_manager.watch()
         
-        if model_path:
-            model = YOLO(model_path)
-            logger.info(f"Loaded custom basketball model from {model_path}")
-            logger.info(f"Model classes: {list(model.names.values())}")
-            return True
-        else:
-            # Fallback to pre-trained model
-            model = YOLO("yolov8n.pt")
-            logger.info("Loaded pre-trained YOLOv8n model")
-            logger.info(f"Model classes: {list(model.names.values())}")
-            return True
+        if model is None:
+            raise RuntimeError("active model version failed to load")
+        
+        if RUNTIME_CALIBRATE:
+            calibrate(model)
+        
+        logger.info(f"Loaded model version {model_version} from {model_path}")
+        logger.info(f"Model classes: {list(model.names.values())}")
+        return True
     except Exception as e:
         logger.error(f"Error loading model: {e}")
         # Mark YOLO as unavailable and continue in demo mode
         YOLO_AVAILABLE = False
         return True
 
+def admin_token_valid():
+    """Constant-time check of the X-Admin-Token header against ADMIN_TOKEN"""
+    token = request.headers.get("X-Admin-Token", "")
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+def require_admin(view):
+    """Reject admin requests without a matching X-Admin-Token header"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return jsonify({"error": "Admin endpoints disabled (ADMIN_TOKEN not set)"}), 403
+        if not admin_token_valid():
+            return jsonify({"error": "Unauthorized"}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+def require_registry(view):
+    """Reject model registry requests while running in demo mode"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not model_manager:
+            return jsonify({"error": "Model registry unavailable in demo mode"}), 503
+        return view(*args, **kwargs)
+    return wrapper
+
+def profiled(view):
+    """
+    Profile the view when an admin asks for it (X-Profile: 1 plus X-Admin-Token)
+    or the request is picked by the sampling rate; the profile id is returned
+    in the X-Profile-Id header.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        requested = request.headers.get("X-Profile") == "1" and admin_token_valid()
+        if not profiler.should_profile(requested):
+            return view(*args, **kwargs)
+
+        # Only admins pick the mode; sampled requests use the configured one
+        mode = request.headers.get("X-Profile-Mode") if admin_token_valid() else None
+        with profiler.profile(request.path, mode=mode) as handle:
+            response = make_response(view(*args, **kwargs))
+        if handle["id"]:
+            response.headers["X-Profile-Id"] = handle["id"]
+        return response
+    return wrapper
+
+def admission_controlled(view):
+    """Run the view under the admission controller: bounded concurrency, deadlines and fast rejection"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        deadline = deadline_from_headers(request.headers)
+        try:
+            with admission.admit(deadline):
+                return view(*args, **kwargs)
+        except Overloaded as e:
+            response = jsonify({"error": "Server busy, retry later", "retry_after": e.retry_after})
+            response.status_code = 503
+            response.headers["Retry-After"] = str(e.retry_after)
+            return response
+        except DeadlineExceeded:
+            return jsonify({"error": "Request deadline exceeded before processing"}), 504
+    return wrapper
+
 @app.route("/")
 def root():
     """Serve the main page"""
@@ -118,10 +216,12 @@ def root():
         "message": "Basketball Detection API",
         "status": "running",
         "mode": "real" if YOLO_AVAILABLE and model else "demo",
-        "endpoints": ["/api/detect", "/api/model-info", "/health"]
+        "endpoints": ["/api/detect", "/api/model-info", "/api/sessions", "/api/stats", "/health"]
     })
 
 @app.route("/api/detect", methods=["POST"])
+@admission_controlled
+@profiled
 def detect():
     """
     Handler for /api/detect POST endpoint
@@ -136,12 +236,37 @@ def detect():
         if file.filename == "":
             return jsonify({"error": "No file selected"}), 400
         
+        # Optionally log this frame into a stored session (webcam / video clients);
+        # validated before inference so a bad field costs nothing
+        try:
+            session_fields = _session_fields()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
         # Process the image
         image = Image.open(file.stream)
         
         if YOLO_AVAILABLE and model:
-            # Use real YOLO model
-            results = detect_objects_on_image(image)
+            # Use real YOLO model; keep this request on the version picked here
+            # even if a new one is swapped in meanwhile
+            version, current_model, shadow = model_manager.select()
+            start_time = time.time()
+            tiled = request.args.get("tiled", TILED_INFERENCE)
+            results = detect_objects_on_image(image, current_model, tiled=tiled)
+            model_manager.stats.record_latency(version, time.time() - start_time)
+            results["model_version"] = version
+            
+            if shadow:
+                model_manager.run_shadow(shadow, detect_objects_on_image, image.copy(), results["detections"], tiled=tiled)
+            
+            if session_fields:
+                # Storage problems are reported but never fail a detection that succeeded
+                try:
+                    results["stored"] = store_detections(current_model, results["detections"], *session_fields)
+                except Exception as e:
+                    logger.error(f"Error storing detections for session {session_fields[0]}: {e}")
+                    results["stored"] = 0
+                    results["store_error"] = str(e)
         else:
             # Use enhanced demo mode
             results = enhanced_demo_detection(image, file.filename)
@@ -152,30 +277,73 @@ def detect():
         logger.error(f"Error in detect endpoint: {e}")
         return jsonify({"error": f"Detection failed: {str(e)}"}), 500
 
-def detect_objects_on_image(image):
+def _session_fields():
+    """
+    Parse the optional "session_id" / "frame" / "timestamp" form fields.
+    Returns None without a session id, else (session_id, frame, timestamp)
+    with None for fields left to their defaults; raises ValueError.
+    """
+    session_id = request.form.get("session_id")
+    if not session_id:
+        return None
+    if not SESSION_ID_PATTERN.match(session_id):
+        raise ValueError("session_id must be 1-64 letters, digits, '-' or '_'")
+    
+    frame = request.form.get("frame")
+    timestamp = request.form.get("timestamp")
+    try:
+        frame = int(frame) if frame is not None else None
+        timestamp = float(timestamp) if timestamp is not None else None
+    except ValueError:
+        raise ValueError("frame must be an integer and timestamp a number")
+    if frame is not None and not 0 <= frame < 2**32:
+        raise ValueError("frame must be a non-negative 32-bit integer")
+    if timestamp is not None and not 0 <= timestamp <= MAX_SESSION_SECONDS:
+        # Session-relative seconds; epoch times would lose all precision in the float32 column
+        raise ValueError(f"timestamp must be seconds since the session started (0-{MAX_SESSION_SECONDS})")
+    return session_id, frame, timestamp
+
+def store_detections(current_model, detections, session_id, frame=None, timestamp=None):
+    """
+    Append one frame of detections to a session in the detection store
+    and feed it to the session's shooting stats.
+    Frame and timestamp default to the session's next frame and seconds
+    since the session was created.
+    """
+    session = detection_store.session(session_id, create=True, names=current_model.names, source="api")
+    
+    name_to_id = {name: class_id for class_id, name in current_model.names.items()}
+    boxes = [d["bbox"] for d in detections]
+    class_ids = [name_to_id[d["class"]] for d in detections]
+    aggregator = session_aggregator(session, current_model.names)
+    
+    # Number, track, store and aggregate under one lock so concurrent uploads stay in frame order
+    with session.frame_lock:
+        frame = session.next_frame() if frame is None else frame
+        track_ids = aggregator.assign_track_ids(frame, boxes, class_ids)
+        frame, timestamp, stored = session.append_frame(
+            boxes,
+            [d["confidence"] for d in detections],
+            class_ids,
+            frame=frame,
+            timestamp=timestamp,
+            track_ids=track_ids,
+        )
+        aggregator.process_frame(frame, timestamp, boxes, class_ids, track_ids)
+    return stored
+
+def detect_objects_on_image(image, current_model=None, tiled=TILED_INFERENCE):
     """
     Function receives an image,
     passes it through YOLO neural network
-    and returns detection results in the format expected by React frontend
+    and returns detection results in the format expected by React frontend.
+    Large images are split into overlapping tiles (see inference/tiling.py) unless tiled="off".
     """
     try:
         start_time = time.time()
+        current_model = current_model or model
         
-        results = model.predict(image, conf=0.25)  # Lower confidence threshold
-        result = results[0]
-        
-        detections = []
-        for box in result.boxes:
-            x1, y1, x2, y2 = [round(x) for x in box.xyxy[0].tolist()]
-            class_id = box.cls[0].item()
-            confidence = round(box.conf[0].item(), 2)
-            class_name = result.names[class_id]
-            
-            detections.append({
-                "class": class_name,
-                "confidence": confidence,
-                "bbox": [x1, y1, x2, y2]
-            })
+        detections = current_model.predict(image, conf=0.25, tiled=tiled).to_dicts()
         
         processing_time = round(time.time() - start_time, 2)
         
@@ -296,12 +464,21 @@ def model_info():
     """Get information about the loaded model - matches React frontend expectations"""
     
     if YOLO_AVAILABLE and model:
-        # Real model info
+        # Real model info, metrics computed for the loaded weights
+        try:
+            source = registry.read()["versions"].get(model_version, {}).get("source")
+            metrics = model_metrics(model_version, model_path, Detector.load, names=model.names, source_path=source)
+        except Exception as e:
+            logger.error(f"Error computing model metrics: {e}")
+            metrics = None
+
         info = {
             "loaded": True,
             "model_type": "YOLOv8 Custom Basketball Model",
             "classes": list(model.names.values()),
-            "performance": "74.1% mAP50-95",
+            "version": model_version,
+            "performance": f"{metrics['mAP50-95'] * 100:.1f}% mAP50-95" if metrics else "Unknown",
+            "metrics": metrics,
             "dataset": "10k basketball images",
             "status": "Custom trained model for basketball analytics"
         }
@@ -319,6 +496,262 @@ def model_info():
     
     return jsonify(info)
 
+@app.route("/api/admin/models", methods=["GET"])
+@require_admin
+@require_registry
+def list_models():
+    """Registry contents, active version, rollout state and per-version latency/agreement"""
+    return jsonify(model_manager.status())
+
+@app.route("/api/admin/models", methods=["POST"])
+@require_admin
+@require_registry
+def register_model():
+    """
+    Register new weights, either uploaded as "weights" or by server-side "path".
+    Pass activate=true to load and swap it in the background.
+    """
+    try:
+        if "weights" in request.files:
+            upload = request.files["weights"]
+            os.makedirs(registry.root, exist_ok=True)
+            tmp_path = os.path.join(registry.root, f"upload-{time.time_ns()}.pt.tmp")
+            upload.save(tmp_path)
+            try:
+                version = registry.register(tmp_path, note=upload.filename)
+            finally:
+                os.remove(tmp_path)
+            activate = request.form.get("activate") == "true"
+        else:
+            payload = request.get_json(silent=True) or {}
+            if not payload.get("path") or not os.path.exists(payload["path"]):
+                return jsonify({"error": "Provide a weights upload or an existing path"}), 400
+            version = registry.register(payload["path"], note=payload.get("note"))
+            activate = bool(payload.get("activate"))
+        
+        if activate:
+            registry.set_active(version)
+            model_manager.sync()
+        
+        return jsonify({"version": version, "activating": activate}), 202 if activate else 201
+    except Exception as e:
+        logger.error(f"Error registering model: {e}")
+        return jsonify({"error": f"Registration failed: {str(e)}"}), 500
+
+@app.route("/api/admin/models/<version>/activate", methods=["POST"])
+@require_admin
+@require_registry
+def activate_model(version):
+    """Load, warm up and swap in a registered version without dropping requests"""
+    try:
+        registry.set_active(version)
+    except KeyError:
+        return jsonify({"error": f"Unknown model version {version}"}), 404
+    
+    model_manager.sync()
+    return jsonify({"version": version, "activating": True}), 202
+
+@app.route("/api/admin/models/<version>/rollout", methods=["POST"])
+@require_admin
+@require_registry
+def rollout_model(version):
+    """
+    Start a shadow or canary rollout.
+    Body: {"mode": "shadow" | "canary", "fraction": 0.1}
+    """
+    payload = request.get_json(silent=True) or {}
+    try:
+        registry.set_rollout(version, payload.get("mode", "shadow"), float(payload.get("fraction", 0.1)))
+    except KeyError:
+        return jsonify({"error": f"Unknown model version {version}"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    model_manager.sync()
+    return jsonify(registry.read()["rollout"]), 202
+
+@app.route("/api/admin/rollout", methods=["DELETE"])
+@require_admin
+@require_registry
+def stop_rollout():
+    """Stop the current shadow or canary rollout"""
+    registry.clear_rollout()
+    model_manager.sync()
+    return jsonify({"rollout": None})
+
+@app.route("/api/sessions")
+def list_sessions():
+    """List stored detection sessions"""
+    return jsonify([detection_store.session(s).summary() for s in detection_store.list_sessions()])
+
+def _range_args():
+    """Parse from/to/by query parameters shared by the session endpoints"""
+    by = request.args.get("by", "timestamp")
+    if by not in ("timestamp", "frame"):
+        raise ValueError("by must be 'timestamp' or 'frame'")
+    cast = float if by == "timestamp" else int
+    start = request.args.get("from")
+    end = request.args.get("to")
+    limit = min(int(request.args.get("limit", 10000)), 100000)
+    return (cast(start) if start is not None else None), (cast(end) if end is not None else None), by, limit
+
+@app.route("/api/sessions/<session_id>/detections")
+def session_detections(session_id):
+    """
+    Stored detections in a time or frame range.
+    Query params: ?from=&to=&class=ball&by=timestamp|frame&limit=10000
+    Returns one list per column.
+    """
+    try:
+        session = detection_store.session(session_id)
+        start, end, by, limit = _range_args()
+        class_id = session.class_id(request.args.get("class"))
+    except KeyError as e:
+        return jsonify({"error": f"Unknown session or class {e}"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    records = session.query_detections(start, end, class_id=class_id, by=by, limit=limit)
+    return jsonify(records_to_json(records, session.class_names))
+
+@app.route("/api/sessions/<session_id>/events")
+def session_events(session_id):
+    """Stored shot events. Query params: ?from=&to=&kind=shot&by=timestamp|frame"""
+    try:
+        session = detection_store.session(session_id)
+        start, end, by, limit = _range_args()
+    except KeyError as e:
+        return jsonify({"error": f"Unknown session {e}"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    kind = request.args.get("kind")
+    if kind is not None and kind not in EVENT_KINDS:
+        return jsonify({"error": f"kind must be one of {EVENT_KINDS}"}), 400
+    
+    records = session.query_events(start, end, kind=kind, by=by, limit=limit)
+    return jsonify(records_to_json(records))
+
+def session_aggregator(session, names=None):
+    """
+    Shooting stats aggregator of a stored session. After a restart it is
+    rebuilt from the shot / made events already in the detection store.
+    """
+    def history():
+        events = session.query_events()
+        return zip(
+            events["frame"].tolist(),
+            events["timestamp"].tolist(),
+            [EVENT_KINDS[k] for k in events["kind"].tolist()],
+            events["track_id"].tolist(),
+        )
+    
+    return get_aggregator(
+        session.session_id,
+        names if names is not None else session.class_names,
+        on_event=session.append_event,
+        history=history,
+    )
+
+def _stats_aggregator(session_id):
+    """Aggregator for an existing session, or None"""
+    try:
+        return session_aggregator(detection_store.session(session_id))
+    except (KeyError, ValueError):
+        return None
+
+@app.route("/api/stats")
+def stats():
+    """
+    Precomputed per-player shooting stats.
+    Query params: ?session=<id> for one session, otherwise all live sessions.
+    """
+    session_id = request.args.get("session")
+    if session_id:
+        aggregator = _stats_aggregator(session_id)
+        if aggregator is None:
+            return jsonify({"error": f"No stats for session {session_id}"}), 404
+        return jsonify(aggregator.snapshot())
+    
+    return jsonify({sid: aggregator.snapshot() for sid, aggregator in list_aggregators().items()})
+
+@app.route("/api/stats/stream")
+def stats_stream():
+    """
+    Server-sent events with a new stats snapshot after every shot or make.
+    Query params: ?session=<id>&since=<version>
+    """
+    session_id = request.args.get("session", "")
+    try:
+        since = int(request.args.get("since", -1))
+    except ValueError:
+        return jsonify({"error": "since must be an integer version"}), 400
+    
+    aggregator = _stats_aggregator(session_id)
+    if aggregator is None:
+        return jsonify({"error": f"No stats for session {session_id}"}), 404
+    
+    def events(version):
+        while True:
+            snapshot = aggregator.wait_for_update(version)
+            if snapshot is None:
+                # Keep-alive so proxies do not close an idle stream
+                yield ": keep-alive\n\n"
+                continue
+            version = snapshot["version"]
+            yield f"id: {version}\ndata: {json.dumps(snapshot)}\n\n"
+    
+    return Response(events(since), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.route("/api/admin/profiles")
+@require_admin
+def list_profiles():
+    """Profiling configuration and the stored request profiles, newest first"""
+    return jsonify({
+        "config": profiler.configure(),
+        "profiles": profiler.store.list()
+    })
+
+@app.route("/api/admin/profiles/config", methods=["POST"])
+@require_admin
+def configure_profiling():
+    """
+    Change profiling without a restart.
+    Body: {"sample_rate": 0.01, "mode": "sample" | "cprofile"}
+    """
+    payload = request.get_json(silent=True) or {}
+    try:
+        sample_rate = payload.get("sample_rate")
+        config = profiler.configure(
+            sample_rate=float(sample_rate) if sample_rate is not None else None,
+            mode=payload.get("mode")
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(config)
+
+@app.route("/api/admin/profiles/<profile_id>")
+@require_admin
+def get_profile(profile_id):
+    """Profile metadata including torch operator timings"""
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        return jsonify({"error": "Invalid profile id"}), 400
+    try:
+        return jsonify(profiler.store.get(profile_id))
+    except FileNotFoundError:
+        return jsonify({"error": f"Unknown profile {profile_id}"}), 404
+
+@app.route("/api/admin/profiles/<profile_id>/data")
+@require_admin
+def get_profile_data(profile_id):
+    """Download the folded-stack (.folded) or cProfile (.prof) data"""
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        return jsonify({"error": "Invalid profile id"}), 400
+    path = profiler.store.data_path(profile_id)
+    if path is None:
+        return jsonify({"error": f"Unknown profile {profile_id}"}), 404
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=os.path.basename(path))
+
 @app.route("/health")
 def health():
     """Health check endpoint"""
@@ -326,7 +759,10 @@ def health():
         "status": "healthy",
         "yolo_available": YOLO_AVAILABLE,
         "model_loaded": model is not None if YOLO_AVAILABLE else "demo_mode",
-        "mode": "real" if (YOLO_AVAILABLE and model) else "demo"
+        "mode": "real" if (YOLO_AVAILABLE and model) else "demo",
+        "model_version": model_version,
+        "admission": admission.status(),
+        "runtime": runtime_settings
     }
     
     if YOLO_AVAILABLE and model:
@@ -0,0 +1,336 @@
+"""
+Compact Detection Store
+DDS70 Project - append-only, memory-mapped per-session detection log
+
+Each session is a directory with one flat binary file per column, so a record
+costs 23 bytes instead of a JSON object and hours of game data can be scanned
+through np.memmap without loading it. Records are appended in frame order,
+which makes the frame and timestamp columns their own index: range queries are
+a binary search plus a slice. Timestamps are seconds since the session
+started, stored as float32 (better than 1/100 s up to MAX_SESSION_SECONDS).
+
+    detections/<session>/meta.json
+    detections/<session>/detections/frame.u4, timestamp.f4, class_id.u1,
+                                     box.i2 (x1 y1 x2 y2), confidence.f2, track_id.i4
+    detections/<session>/events/frame.u4, timestamp.f4, kind.u1, track_id.i4, point.i2 (x y)
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+STORE_DIR = os.environ.get("DETECTION_STORE_DIR", "detections")
+
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# Longest session in seconds; float32 timestamps keep ~8 ms resolution up to here
+MAX_SESSION_SECONDS = 86400
+
+# (name, dtype, values per record)
+DETECTION_COLUMNS = (
+    ("frame", np.uint32, 1),
+    ("timestamp", np.float32, 1),
+    ("class_id", np.uint8, 1),
+    ("box", np.int16, 4),
+    ("confidence", np.float16, 1),
+    ("track_id", np.int32, 1),
+)
+
+EVENT_COLUMNS = (
+    ("frame", np.uint32, 1),
+    ("timestamp", np.float32, 1),
+    ("kind", np.uint8, 1),
+    ("track_id", np.int32, 1),
+    ("point", np.int16, 2),
+)
+
+EVENT_KINDS = ["shot", "made"]
+
+NO_TRACK = -1
+
+# Records scanned per step when filtering a range by class
+QUERY_BLOCK = 1 << 16
+
+
+def _column_path(directory, name, dtype):
+    return os.path.join(directory, f"{name}.{np.dtype(dtype).str[1:]}")
+
+
+class ColumnTable:
+    """Append-only table stored as one flat binary file per column"""
+
+    def __init__(self, directory, columns):
+        self.directory = directory
+        self.columns = columns
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def __len__(self):
+        # A torn append leaves some columns longer; the shortest one is authoritative
+        lengths = []
+        for name, dtype, width in self.columns:
+            path = _column_path(self.directory, name, dtype)
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            lengths.append(size // (np.dtype(dtype).itemsize * width))
+        return min(lengths)
+
+    def column(self, name, length=None):
+        """Memory-mapped read-only view of one column"""
+        length = len(self) if length is None else length
+        for col_name, dtype, width in self.columns:
+            if col_name == name:
+                break
+        else:
+            raise KeyError(name)
+
+        shape = (length, width) if width > 1 else (length,)
+        if length == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(_column_path(self.directory, name, dtype), dtype=dtype, mode="r", shape=shape)
+
+    def append(self, values):
+        """Append equal-length arrays, one per column, keeping frame and timestamp non-decreasing"""
+        arrays = {}
+        count = None
+        for name, dtype, width in self.columns:
+            array = np.asarray(values[name], dtype=dtype)
+            array = array.reshape(-1, width) if width > 1 else array.reshape(-1)
+            if count is None:
+                count = len(array)
+            elif len(array) != count:
+                raise ValueError(f"column {name} has {len(array)} values, expected {count}")
+            arrays[name] = array
+
+        if not count:
+            return 0
+
+        for name in ("frame", "timestamp"):
+            if np.any(np.diff(arrays[name]) < 0):
+                raise ValueError(f"{name} values must be non-decreasing")
+
+        with self._lock:
+            length = len(self)
+            if length:
+                for name in ("frame", "timestamp"):
+                    if arrays[name][0] < self.column(name, length)[-1]:
+                        raise ValueError(f"{name} values must not go back in time")
+
+            for name, dtype, width in self.columns:
+                path = _column_path(self.directory, name, dtype)
+                with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+                    # Truncate any torn tail before appending
+                    f.truncate(length * np.dtype(dtype).itemsize * width)
+                    f.seek(0, os.SEEK_END)
+                    f.write(np.ascontiguousarray(arrays[name]).tobytes())
+
+        return count
+
+    def range(self, start=None, end=None, by="timestamp"):
+        """Record slice [lo, hi) whose frame or timestamp falls within [start, end]"""
+        length = len(self)
+        if length == 0:
+            return 0, 0
+
+        key = self.column(by, length)
+        lo = 0 if start is None else int(np.searchsorted(key, start, side="left"))
+        hi = length if end is None else int(np.searchsorted(key, end, side="right"))
+        return lo, max(lo, hi)
+
+    def read(self, lo, hi):
+        length = len(self)
+        return {name: np.array(self.column(name, length)[lo:hi]) for name, _, _ in self.columns}
+
+    def take(self, indices):
+        """Copy only the given records out of the memory-mapped columns"""
+        length = len(self)
+        return {name: np.asarray(self.column(name, length)[indices]) for name, _, _ in self.columns}
+
+
+class Session:
+    """One recording or live run: detections, shot events and class names"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.session_id = os.path.basename(directory)
+        self.detections = ColumnTable(os.path.join(directory, "detections"), DETECTION_COLUMNS)
+        self.events = ColumnTable(os.path.join(directory, "events"), EVENT_COLUMNS)
+        # Held while a frame is numbered, stored and fed to consumers, so frames stay in order
+        self.frame_lock = threading.RLock()
+        self._meta = None
+
+    @property
+    def meta(self):
+        if self._meta is None:
+            try:
+                with open(os.path.join(self.directory, "meta.json")) as f:
+                    self._meta = json.load(f)
+            except FileNotFoundError:
+                self._meta = {}
+        return self._meta
+
+    def write_meta(self, **fields):
+        meta = dict(self.meta, **fields)
+        tmp_path = os.path.join(self.directory, "meta.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp_path, os.path.join(self.directory, "meta.json"))
+        self._meta = meta
+
+    @property
+    def class_names(self):
+        return {int(k): v for k, v in self.meta.get("names", {}).items()}
+
+    def class_id(self, value):
+        """Resolve a class name or numeric id to an id"""
+        if value is None:
+            return None
+        if str(value).isdigit():
+            return int(value)
+        for class_id, name in self.class_names.items():
+            if name == value:
+                return class_id
+        raise KeyError(value)
+
+    def next_frame(self):
+        """Index after the last frame appended, counting frames without detections"""
+        return self.meta.get("frames", 0)
+
+    def append_frame(self, boxes, confidences, class_ids, frame=None, timestamp=None, track_ids=None):
+        """
+        Append one frame's detections, including an empty frame.
+        frame defaults to the next frame index and timestamp to seconds since
+        the session was created. Returns (frame, timestamp, stored count).
+        """
+        with self.frame_lock:
+            frame = self.next_frame() if frame is None else frame
+            timestamp = time.time() - self.meta["created_at"] if timestamp is None else timestamp
+            if not 0 <= timestamp <= MAX_SESSION_SECONDS:
+                raise ValueError(f"timestamp must be 0-{MAX_SESSION_SECONDS} seconds since the session started")
+            stored = self.append_detections(frame, timestamp, boxes, confidences, class_ids, track_ids)
+            if frame >= self.next_frame():
+                self.write_meta(frames=frame + 1)
+        return frame, timestamp, stored
+
+    def append_detections(self, frame, timestamp, boxes, confidences, class_ids, track_ids=None):
+        """Append one frame's detections (xyxy pixel boxes)"""
+        count = len(class_ids)
+        if track_ids is None:
+            track_ids = np.full(count, NO_TRACK)
+        boxes = np.clip(np.round(np.asarray(boxes, dtype=np.float32)), -32768, 32767)
+        return self.detections.append({
+            "frame": np.full(count, frame),
+            "timestamp": np.full(count, timestamp),
+            "class_id": class_ids,
+            "box": boxes,
+            "confidence": confidences,
+            "track_id": track_ids,
+        })
+
+    def append_event(self, frame, timestamp, kind, track_id=NO_TRACK, point=(0, 0)):
+        return self.events.append({
+            "frame": [frame],
+            "timestamp": [timestamp],
+            "kind": [EVENT_KINDS.index(kind)],
+            "track_id": [track_id],
+            "point": [point],
+        })
+
+    def query_detections(self, start=None, end=None, class_id=None, by="timestamp", limit=None):
+        lo, hi = self.detections.range(start, end, by)
+        if class_id is None:
+            if limit is not None:
+                hi = min(hi, lo + limit)
+            return self.detections.read(lo, hi)
+
+        # Scan the class column block by block and stop at limit matches, so a
+        # sparse class over a whole game never copies the full range into memory
+        class_column = self.detections.column("class_id")
+        matches = []
+        found = 0
+        for block_lo in range(lo, hi, QUERY_BLOCK):
+            block = class_column[block_lo:min(hi, block_lo + QUERY_BLOCK)]
+            indices = np.flatnonzero(block == class_id) + block_lo
+            if limit is not None:
+                indices = indices[:limit - found]
+            matches.append(indices)
+            found += len(indices)
+            if limit is not None and found >= limit:
+                break
+
+        indices = np.concatenate(matches) if matches else np.zeros(0, dtype=np.int64)
+        return self.detections.take(indices)
+
+    def query_events(self, start=None, end=None, kind=None, by="timestamp", limit=None):
+        lo, hi = self.events.range(start, end, by)
+        records = self.events.read(lo, hi)
+        if kind is not None:
+            mask = records["kind"] == EVENT_KINDS.index(kind)
+            records = {name: values[mask] for name, values in records.items()}
+        return {name: values[:limit] for name, values in records.items()}
+
+    def summary(self):
+        return {
+            "session_id": self.session_id,
+            "detections": len(self.detections),
+            "events": len(self.events),
+            **self.meta,
+        }
+
+
+class DetectionStore:
+    """Directory of sessions"""
+
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def session(self, session_id, create=False, names=None, source=None):
+        if not SESSION_ID_PATTERN.match(session_id or ""):
+            raise ValueError("session id must be 1-64 letters, digits, '-' or '_'")
+
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                directory = os.path.join(self.root, session_id)
+                if not os.path.isdir(directory):
+                    if not create:
+                        raise KeyError(session_id)
+                    os.makedirs(directory)
+                session = Session(directory)
+                self._sessions[session_id] = session
+
+            if create and not session.meta:
+                session.write_meta(
+                    names={str(k): v for k, v in (names or {}).items()},
+                    source=source,
+                    created_at=time.time(),
+                )
+        return session
+
+    def list_sessions(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            name for name in os.listdir(self.root)
+            if SESSION_ID_PATTERN.match(name) and os.path.isdir(os.path.join(self.root, name))
+        )
+
+
+def records_to_json(records, names=None):
+    """Column-oriented JSON (one list per column) to keep responses compact"""
+    output = {name: values.tolist() for name, values in records.items()}
+    if "confidence" in output:
+        output["confidence"] = [round(c, 3) for c in output["confidence"]]
+    if names is not None and "class_id" in output:
+        output["class"] = [names.get(c, str(c)) for c in output["class_id"]]
+    if "kind" in output:
+        output["kind"] = [EVENT_KINDS[k] for k in output["kind"]]
+    return output
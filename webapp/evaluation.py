@@ -0,0 +1,517 @@
+"""
+Model Evaluation and Metrics Report
+DDS70 Project - mAP / precision / recall / confusion matrix for the loaded weights
+
+Predictions are matched against ground truth with vectorized IoU matrices and
+the per-prediction match table is persisted, so new labelled batches only need
+to be matched once and the report is rebuilt from the stored table.
+"""
+
+import csv
+import glob
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from inference import box_iou
+
+logger = logging.getLogger(__name__)
+
+# IoU thresholds 0.50:0.05:0.95 used for mAP50-95
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+
+# Confusion matrix uses the same thresholds as the Ultralytics validator
+CONFUSION_CONF = 0.25
+CONFUSION_IOU = 0.45
+
+# Low confidence threshold so the PR curve covers the full recall range
+EVAL_CONF = 0.001
+
+METRICS_DIR = os.environ.get("METRICS_DIR", "metrics")
+EVAL_DATA_DIR = os.environ.get("EVAL_DATA_DIR")
+# Seconds between checks of the evaluation set for new labelled images
+EVAL_REFRESH = float(os.environ.get("EVAL_REFRESH", "300"))
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+EPS = 1e-16
+
+
+def _unique_matches(matches, scores):
+    """Greedy one-to-one matching: keep the highest scoring pair per row and column"""
+    if matches.shape[0] > 1:
+        matches = matches[scores.argsort()[::-1]]
+        matches = matches[np.unique(matches[:, 1], return_index=True)[1]]
+        matches = matches[np.unique(matches[:, 0], return_index=True)[1]]
+    return matches
+
+
+def match_predictions(pred_boxes, pred_cls, gt_boxes, gt_cls):
+    """
+    Mark each prediction as a true positive at every IoU threshold.
+    Returns a boolean array of shape (num_predictions, len(IOU_THRESHOLDS)).
+    """
+    correct = np.zeros((len(pred_cls), len(IOU_THRESHOLDS)), dtype=bool)
+    if len(pred_cls) == 0 or len(gt_cls) == 0:
+        return correct
+
+    # (num_gt, num_pred) IoU, zeroed where the classes disagree
+    iou = box_iou(gt_boxes, pred_boxes)
+    iou = iou * (gt_cls[:, None] == pred_cls[None, :])
+
+    for i, threshold in enumerate(IOU_THRESHOLDS):
+        gt_idx, pred_idx = np.nonzero(iou >= threshold)
+        if gt_idx.size == 0:
+            continue
+        matches = np.stack([gt_idx, pred_idx], axis=1)
+        matches = _unique_matches(matches, iou[gt_idx, pred_idx])
+        correct[matches[:, 1], i] = True
+
+    return correct
+
+
+def compute_ap(recall, precision):
+    """Area under the monotonic precision envelope of a single PR curve"""
+    mrec = np.concatenate(([0.0], recall, [1.0]))
+    mpre = np.concatenate(([1.0], precision, [0.0]))
+    mpre = np.flip(np.maximum.accumulate(np.flip(mpre)))
+
+    i = np.where(mrec[1:] != mrec[:-1])[0]
+    return float(np.sum((mrec[i + 1] - mrec[i]) * mpre[i + 1]))
+
+
+def ap_per_class(tp, conf, pred_cls, target_cls):
+    """
+    Compute per-class AP at every IoU threshold plus precision and recall
+    at the confidence that maximises mean F1 across classes.
+    """
+    order = np.argsort(-conf)
+    tp, conf, pred_cls = tp[order], conf[order], pred_cls[order]
+
+    classes, num_targets = np.unique(target_cls, return_counts=True)
+    x = np.linspace(0, 1, 1000)
+    ap = np.zeros((len(classes), tp.shape[1]))
+    p_curve = np.zeros((len(classes), 1000))
+    r_curve = np.zeros((len(classes), 1000))
+
+    for ci, c in enumerate(classes):
+        mask = pred_cls == c
+        if not mask.any():
+            continue
+
+        tpc = tp[mask].cumsum(0)
+        fpc = (1 - tp[mask]).cumsum(0)
+        recall = tpc / (num_targets[ci] + EPS)
+        precision = tpc / (tpc + fpc)
+
+        # Curves against confidence (conf is descending, so negate for interp)
+        r_curve[ci] = np.interp(-x, -conf[mask], recall[:, 0], left=0)
+        p_curve[ci] = np.interp(-x, -conf[mask], precision[:, 0], left=1)
+
+        for j in range(tp.shape[1]):
+            ap[ci, j] = compute_ap(recall[:, j], precision[:, j])
+
+    f1 = 2 * p_curve * r_curve / (p_curve + r_curve + EPS)
+    best = int(f1.mean(0).argmax()) if len(classes) else 0
+
+    return {
+        "classes": classes.astype(int),
+        "num_targets": num_targets,
+        "precision": p_curve[:, best],
+        "recall": r_curve[:, best],
+        "f1": f1[:, best],
+        "ap": ap,
+        "best_conf": float(x[best]),
+    }
+
+
+class MetricsAccumulator:
+    """
+    Incremental detection metrics.
+
+    Each labelled image is matched once and its match table appended;
+    summarize() rebuilds mAP / precision / recall from the stored table,
+    which is cheap compared to re-running inference on the whole set.
+    """
+
+    def __init__(self, names):
+        self.names = dict(names)
+        self.num_classes = len(self.names)
+        self.tp = []
+        self.conf = []
+        self.pred_cls = []
+        self.target_cls = []
+        self.confusion = np.zeros((self.num_classes + 1, self.num_classes + 1), dtype=np.int64)
+        self.seen = set()
+        self._summary = None
+
+    def update(self, image_id, pred_boxes, pred_conf, pred_cls, gt_boxes, gt_cls):
+        """Add one image worth of predictions and ground truth"""
+        if image_id in self.seen:
+            return False
+
+        pred_boxes = np.asarray(pred_boxes, dtype=np.float32).reshape(-1, 4)
+        pred_conf = np.asarray(pred_conf, dtype=np.float32).reshape(-1)
+        pred_cls = np.asarray(pred_cls, dtype=np.int64).reshape(-1)
+        gt_boxes = np.asarray(gt_boxes, dtype=np.float32).reshape(-1, 4)
+        gt_cls = np.asarray(gt_cls, dtype=np.int64).reshape(-1)
+
+        # Drop rows with unknown class ids before touching any state, so one bad
+        # label file cannot leave the match table and confusion matrix out of step
+        valid_gt = (gt_cls >= 0) & (gt_cls < self.num_classes)
+        if not valid_gt.all():
+            logger.warning(f"Skipping {int((~valid_gt).sum())} labels with unknown class ids in {image_id}")
+            gt_boxes, gt_cls = gt_boxes[valid_gt], gt_cls[valid_gt]
+        valid_pred = (pred_cls >= 0) & (pred_cls < self.num_classes)
+        if not valid_pred.all():
+            pred_boxes, pred_conf, pred_cls = pred_boxes[valid_pred], pred_conf[valid_pred], pred_cls[valid_pred]
+
+        self.tp.append(match_predictions(pred_boxes, pred_cls, gt_boxes, gt_cls))
+        self.conf.append(pred_conf)
+        self.pred_cls.append(pred_cls)
+        self.target_cls.append(gt_cls)
+        self._update_confusion(pred_boxes, pred_conf, pred_cls, gt_boxes, gt_cls)
+
+        self.seen.add(image_id)
+        self._summary = None
+        return True
+
+    def _update_confusion(self, pred_boxes, pred_conf, pred_cls, gt_boxes, gt_cls):
+        """Confusion matrix rows are predicted class, columns true class; last index is background"""
+        background = self.num_classes
+        keep = pred_conf > CONFUSION_CONF
+        pred_boxes, pred_cls = pred_boxes[keep], pred_cls[keep]
+
+        if len(gt_cls) == 0:
+            np.add.at(self.confusion, (pred_cls, background), 1)
+            return
+        if len(pred_cls) == 0:
+            np.add.at(self.confusion, (background, gt_cls), 1)
+            return
+
+        iou = box_iou(gt_boxes, pred_boxes)
+        gt_idx, pred_idx = np.nonzero(iou > CONFUSION_IOU)
+        matches = np.stack([gt_idx, pred_idx], axis=1)
+        matches = _unique_matches(matches, iou[gt_idx, pred_idx])
+
+        matched_gt = np.zeros(len(gt_cls), dtype=bool)
+        matched_pred = np.zeros(len(pred_cls), dtype=bool)
+        if matches.size:
+            matched_gt[matches[:, 0]] = True
+            matched_pred[matches[:, 1]] = True
+            np.add.at(self.confusion, (pred_cls[matches[:, 1]], gt_cls[matches[:, 0]]), 1)
+
+        np.add.at(self.confusion, (background, gt_cls[~matched_gt]), 1)
+        np.add.at(self.confusion, (pred_cls[~matched_pred], background), 1)
+
+    def summarize(self):
+        """Build the metrics report, cached until the next update"""
+        if self._summary is not None:
+            return self._summary
+
+        if not self.seen:
+            return None
+
+        tp = np.concatenate(self.tp) if self.tp else np.zeros((0, len(IOU_THRESHOLDS)), dtype=bool)
+        conf = np.concatenate(self.conf)
+        pred_cls = np.concatenate(self.pred_cls)
+        target_cls = np.concatenate(self.target_cls)
+
+        stats = ap_per_class(tp, conf, pred_cls, target_cls)
+        ap = stats["ap"]
+
+        per_class = {}
+        for i, c in enumerate(stats["classes"]):
+            per_class[self.names.get(int(c), str(c))] = {
+                "instances": int(stats["num_targets"][i]),
+                "precision": round(float(stats["precision"][i]), 4),
+                "recall": round(float(stats["recall"][i]), 4),
+                "mAP50": round(float(ap[i, 0]), 4),
+                "mAP50-95": round(float(ap[i].mean()), 4),
+            }
+
+        labels = [self.names[i] for i in sorted(self.names)] + ["background"]
+        self._summary = {
+            "source": "evaluation",
+            "images": len(self.seen),
+            "instances": int(len(target_cls)),
+            "precision": round(float(stats["precision"].mean()), 4) if len(ap) else 0.0,
+            "recall": round(float(stats["recall"].mean()), 4) if len(ap) else 0.0,
+            "mAP50": round(float(ap[:, 0].mean()), 4) if len(ap) else 0.0,
+            "mAP50-95": round(float(ap.mean()), 4) if len(ap) else 0.0,
+            "best_conf": round(stats["best_conf"], 3),
+            "per_class": per_class,
+            "confusion_matrix": {
+                "labels": labels,
+                "matrix": self.confusion.tolist(),
+            },
+        }
+        return self._summary
+
+    def save(self, path):
+        """Persist the match table so later runs only evaluate new images"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        width = len(IOU_THRESHOLDS)
+        tmp_path = path + ".tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            tp=np.concatenate(self.tp) if self.tp else np.zeros((0, width), dtype=bool),
+            conf=np.concatenate(self.conf) if self.conf else np.zeros(0, dtype=np.float32),
+            pred_cls=np.concatenate(self.pred_cls) if self.pred_cls else np.zeros(0, dtype=np.int64),
+            target_cls=np.concatenate(self.target_cls) if self.target_cls else np.zeros(0, dtype=np.int64),
+            confusion=self.confusion,
+            seen=np.array(sorted(self.seen), dtype=str),
+            names=np.array([self.names[i] for i in sorted(self.names)], dtype=str),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, names):
+        """Restore a saved match table, or start empty if missing or for a different class set"""
+        acc = cls(names)
+        if not os.path.exists(path):
+            return acc
+
+        try:
+            data = np.load(path)
+            saved_names = list(data["names"])
+            if saved_names != [acc.names[i] for i in sorted(acc.names)]:
+                logger.warning(f"Ignoring metrics store {path}: class names changed")
+                return acc
+
+            acc.tp = [data["tp"]]
+            acc.conf = [data["conf"]]
+            acc.pred_cls = [data["pred_cls"]]
+            acc.target_cls = [data["target_cls"]]
+            acc.confusion = data["confusion"]
+            acc.seen = set(data["seen"].tolist())
+        except Exception as e:
+            logger.error(f"Error loading metrics store {path}: {e}")
+            return cls(names)
+
+        return acc
+
+
+def read_yolo_labels(label_path, width, height):
+    """Read a YOLO label file (class cx cy w h, normalised) into pixel xyxy boxes"""
+    if not os.path.exists(label_path):
+        return np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.int64)
+
+    rows = np.loadtxt(label_path, ndmin=2, dtype=np.float32)
+    if rows.size == 0:
+        return np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.int64)
+
+    cls = rows[:, 0].astype(np.int64)
+    cx, cy = rows[:, 1] * width, rows[:, 2] * height
+    w, h = rows[:, 3] * width, rows[:, 4] * height
+    boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+    return boxes, cls
+
+
+def pending_images(data_dir, seen):
+    """Image paths under data_dir/images whose ids are not in seen"""
+    images_dir = os.path.join(data_dir, "images")
+    image_paths = sorted(
+        p for p in glob.glob(os.path.join(images_dir, "**", "*"), recursive=True)
+        if p.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    return [p for p in image_paths if os.path.relpath(p, images_dir) not in seen]
+
+
+def update_from_directory(acc, detector, data_dir, batch_size=16, pending=None):
+    """
+    Evaluate labelled images under data_dir/images with labels in data_dir/labels.
+    Only images not already in the accumulator (or the given pending list)
+    are run through the detector. Returns the number of newly evaluated images.
+    """
+    images_dir = os.path.join(data_dir, "images")
+    labels_dir = os.path.join(data_dir, "labels")
+    if pending is None:
+        pending = pending_images(data_dir, acc.seen)
+
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        results = detector.predict_batch(batch, conf=EVAL_CONF)
+
+        for path, detections in zip(batch, results):
+            image_id = os.path.relpath(path, images_dir)
+            width, height = detections.image_size
+            label_path = os.path.join(labels_dir, os.path.splitext(image_id)[0] + ".txt")
+            try:
+                gt_boxes, gt_cls = read_yolo_labels(label_path, width, height)
+            except (ValueError, IndexError) as e:
+                logger.warning(f"Skipping {image_id}: malformed label file ({e})")
+                continue
+
+            acc.update(
+                image_id,
+                detections.boxes,
+                detections.scores,
+                detections.class_ids,
+                gt_boxes,
+                gt_cls,
+            )
+
+    if pending:
+        logger.info(f"Evaluated {len(pending)} new labelled images ({len(acc.seen)} total)")
+    return len(pending)
+
+
+def read_training_results(results_csv):
+    """
+    Read the Ultralytics training log (results.csv, whitespace padded columns)
+    and return the metrics of the best epoch by fitness (0.1 * mAP50 + 0.9 * mAP50-95).
+    """
+    if not results_csv or not os.path.exists(results_csv):
+        return None
+
+    best = None
+    with open(results_csv, newline="") as f:
+        reader = csv.reader(f)
+        header = [h.strip() for h in next(reader)]
+        for row in reader:
+            if not row:
+                continue
+            values = dict(zip(header, (v.strip() for v in row)))
+            try:
+                map50 = float(values["metrics/mAP50(B)"])
+                map50_95 = float(values["metrics/mAP50-95(B)"])
+                epoch = {
+                    "epoch": int(float(values["epoch"])),
+                    "precision": float(values["metrics/precision(B)"]),
+                    "recall": float(values["metrics/recall(B)"]),
+                    "mAP50": map50,
+                    "mAP50-95": map50_95,
+                }
+            except (KeyError, ValueError):
+                continue
+
+            fitness = 0.1 * map50 + 0.9 * map50_95
+            if best is None or fitness > best[0]:
+                best = (fitness, epoch)
+
+    if best is None:
+        return None
+
+    return dict(best[1], source="training")
+
+
+# Per model version: {"evaluation": summary, "training": summary, "checked": time}
+_summaries = {}
+# Per model version: MetricsAccumulator kept between refreshes
+_accumulators = {}
+# (version, detector) of the last evaluated version, reused across refreshes
+_eval_detector = None
+# Versions with an evaluation job running
+_running = set()
+_lock = threading.Lock()
+
+
+def _detector_for(version, weights_path, loader):
+    """Private evaluation detector for a version; only the latest one is kept loaded"""
+    global _eval_detector
+    if _eval_detector is None or _eval_detector[0] != version:
+        _eval_detector = None
+        _eval_detector = (version, loader(weights_path))
+    return _eval_detector[1]
+
+
+def _evaluate(version, weights_path, loader, data_dir, names):
+    """
+    Background job: evaluate new labelled images with a private detector instance.
+    Ultralytics keeps one predictor per model and overwrites its arguments on
+    every call, so the serving detector must never see EVAL_CONF. The model is
+    only loaded when there are images the match table has not seen.
+    """
+    try:
+        store_path = os.path.join(METRICS_DIR, f"{version}.npz")
+        acc = _accumulators.get(version)
+        if acc is None:
+            if names is None:
+                names = _detector_for(version, weights_path, loader).names
+            acc = _accumulators[version] = MetricsAccumulator.load(store_path, names)
+
+        pending = pending_images(data_dir, acc.seen)
+        if pending:
+            detector = _detector_for(version, weights_path, loader)
+            update_from_directory(acc, detector, data_dir, pending=pending)
+            acc.save(store_path)
+        summary = acc.summarize()
+        if summary is not None:
+            with _lock:
+                _summaries.setdefault(version, {})["evaluation"] = dict(summary, version=version)
+    except Exception as e:
+        logger.error(f"Error evaluating model {version}: {e}")
+    finally:
+        with _lock:
+            _summaries.setdefault(version, {})["checked"] = time.time()
+            _running.discard(version)
+
+
+def start_evaluation(version, weights_path, loader, data_dir=None, names=None):
+    """
+    Evaluate a model version on the labelled set (EVAL_DATA_DIR) in a background
+    thread; loader(weights_path) must return a new Detector. Passing the model's
+    class names avoids loading it when nothing new is labelled. Returns False if
+    there is no evaluation set or a job for this version is already running.
+    """
+    data_dir = data_dir or EVAL_DATA_DIR
+    if not data_dir or not os.path.isdir(data_dir):
+        return False
+
+    with _lock:
+        if version in _running:
+            return False
+        _running.add(version)
+
+    threading.Thread(
+        target=_evaluate,
+        args=(version, weights_path, loader, data_dir, names),
+        daemon=True,
+        name=f"evaluate-{version}",
+    ).start()
+    return True
+
+
+def model_metrics(version, weights_path, loader=None, names=None, data_dir=None, source_path=None):
+    """
+    Metrics report for a model version, without running the model.
+
+    With a labelled evaluation set (EVAL_DATA_DIR) the report comes from the
+    last evaluation of this version; the first call, and the first call every
+    EVAL_REFRESH seconds after that, starts a background job with loader that
+    evaluates labelled images not seen before.
+    Until one has finished, and without an evaluation set, it falls back to
+    the best epoch of the training log that sits next to the weights (or next
+    to source_path, where they were copied from).
+    """
+    data_dir = data_dir or EVAL_DATA_DIR
+    if not version or not weights_path or not os.path.exists(weights_path):
+        return None
+
+    with _lock:
+        cached = dict(_summaries.get(version, {}))
+        running = version in _running
+
+    stale = time.time() - cached.get("checked", 0) > EVAL_REFRESH
+    if loader is not None and not running and stale:
+        running = start_evaluation(version, weights_path, loader, data_dir, names)
+
+    if "evaluation" in cached:
+        return dict(cached["evaluation"], evaluating=running)
+
+    if "training" not in cached:
+        run_dir = os.path.dirname(os.path.dirname(os.path.abspath(source_path or weights_path)))
+        summary = read_training_results(os.path.join(run_dir, "results.csv"))
+        if summary is not None:
+            summary["version"] = version
+        with _lock:
+            _summaries.setdefault(version, {})["training"] = summary
+        cached["training"] = summary
+
+    if cached["training"] is None:
+        return None
+    return dict(cached["training"], evaluating=running)
@@ -0,0 +1,21 @@
+"""
+DDS70 Inference Core
+Single Detector API shared by app.py, webapp/app.py and demo.py
+"""
+
+from .boxes import box_iou
+from .detector import DEFAULT_WEIGHTS, Detections, Detector, find_weights, weights_hash
+from .tiling import TILED_INFERENCE
+from .video_cache import CachedVideoAnalyzer, VideoIndex
+
+__all__ = [
+    "DEFAULT_WEIGHTS",
+    "TILED_INFERENCE",
+    "CachedVideoAnalyzer",
+    "Detections",
+    "Detector",
+    "VideoIndex",
+    "box_iou",
+    "find_weights",
+    "weights_hash",
+]
@@ -0,0 +1,25 @@
+"""
+Box geometry shared by tiling, evaluation, rollout comparison and tracking
+"""
+
+import numpy as np
+
+EPS = 1e-16
+
+
+def box_iou(boxes1, boxes2):
+    """
+    Pairwise IoU between two sets of xyxy boxes.
+    Returns an (N, M) matrix for N boxes in boxes1 and M boxes in boxes2.
+    """
+    boxes1 = np.asarray(boxes1, dtype=np.float32).reshape(-1, 4)
+    boxes2 = np.asarray(boxes2, dtype=np.float32).reshape(-1, 4)
+
+    area1 = (boxes1[:, 2] - boxes1[:, 0]) * (boxes1[:, 3] - boxes1[:, 1])
+    area2 = (boxes2[:, 2] - boxes2[:, 0]) * (boxes2[:, 3] - boxes2[:, 1])
+
+    top_left = np.maximum(boxes1[:, None, :2], boxes2[None, :, :2])
+    bottom_right = np.minimum(boxes1[:, None, 2:], boxes2[None, :, 2:])
+    inter = np.clip(bottom_right - top_left, 0, None).prod(axis=2)
+
+    return inter / (area1[:, None] + area2[None, :] - inter + EPS)
@@ -0,0 +1,249 @@
+"""
+Detector - model loading and box extraction in one place
+
+Every entry point goes through Detector, so performance features (tiling,
+runtime tuning, channels-last) are implemented once, and class names always
+come from the loaded weights instead of hard-coded lists.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+
+import numpy as np
+
+from .tiling import TILED_INFERENCE, predict_video, should_tile, tiled_predict
+
+logger = logging.getLogger(__name__)
+
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Custom basketball weights, tried in order; handles running from the repo root,
+# from webapp/, and the Docker layout where the weights sit next to webapp/
+DEFAULT_WEIGHTS = [
+    os.path.join(_REPO_ROOT, "trainon10kdataset", "weights", "best.pt"),
+    "trainon10kdataset/weights/best.pt",
+    "../trainon10kdataset/weights/best.pt",
+    "webapp/trainon10kdataset/weights/best.pt",
+]
+
+PRETRAINED_WEIGHTS = "yolov8n.pt"
+
+DEFAULT_CONF = 0.25
+
+# Longer side uploads are downscaled to before inference; bounds decode and tiling cost
+MAX_IMAGE_SIDE = int(os.environ.get("MAX_IMAGE_SIDE", "3840"))
+
+
+def find_weights(candidates=DEFAULT_WEIGHTS):
+    """First existing custom weights file, or None"""
+    for path in candidates:
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def weights_hash(path, chunk_size=1 << 20):
+    """Return the sha256 of a weights file, used as the model version and cache key"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Detections:
+    """Boxes (xyxy pixels), confidences, class ids and optional track ids for one image"""
+
+    __slots__ = ("boxes", "scores", "class_ids", "track_ids", "names", "image_size")
+
+    def __init__(self, boxes, scores, class_ids, names, image_size, track_ids=None):
+        self.boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        self.scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+        self.class_ids = np.asarray(class_ids, dtype=np.int64).reshape(-1)
+        self.track_ids = None if track_ids is None else np.asarray(track_ids, dtype=np.int64).reshape(-1)
+        self.names = names
+        self.image_size = image_size  # (width, height)
+
+    @classmethod
+    def from_result(cls, result):
+        """Build from an Ultralytics Results object"""
+        boxes = result.boxes
+        height, width = result.orig_shape[:2]
+        return cls(
+            boxes.xyxy.cpu().numpy(),
+            boxes.conf.cpu().numpy(),
+            boxes.cls.cpu().numpy(),
+            result.names,
+            (width, height),
+            boxes.id.cpu().numpy() if boxes.id is not None else None,
+        )
+
+    def __len__(self):
+        return len(self.class_ids)
+
+    def __iter__(self):
+        """Yield (x1, y1, x2, y2, class_name, confidence) per detection"""
+        for (x1, y1, x2, y2), score, class_id in zip(self.boxes.tolist(), self.scores.tolist(), self.class_ids.tolist()):
+            yield x1, y1, x2, y2, self.names[class_id], score
+
+    def to_dicts(self):
+        """Format used by the webapp API and React frontend"""
+        return [
+            {"class": name, "confidence": round(score, 2), "bbox": [round(x1), round(y1), round(x2), round(y2)]}
+            for x1, y1, x2, y2, name, score in self
+        ]
+
+    def to_lists(self):
+        """Format used by the root app.py /detect endpoint"""
+        return [
+            [round(x1), round(y1), round(x2), round(y2), name, round(score, 2)]
+            for x1, y1, x2, y2, name, score in self
+        ]
+
+
+class Detector:
+    """
+    YOLO model wrapper with one-image, batch and stream prediction.
+
+    Images may be PIL images, BGR numpy arrays or file paths. Ultralytics
+    models keep per-call predictor state, so calls into one model are
+    serialised; run several Detectors for concurrent inference.
+    """
+
+    def __init__(self, model, weights_path=None, conf=DEFAULT_CONF, tiled=TILED_INFERENCE):
+        self.model = model
+        self.weights_path = weights_path or getattr(model, "ckpt_path", None)
+        self.conf = conf
+        self.tiled = tiled
+        self._lock = threading.RLock()
+
+    @classmethod
+    def load(cls, weights=None, **kwargs):
+        """
+        Load the given weights, or the custom basketball model if present,
+        falling back to pre-trained YOLOv8n.
+        """
+        from ultralytics import YOLO
+
+        weights = weights or find_weights() or PRETRAINED_WEIGHTS
+        model = YOLO(weights)
+        logger.info(f"Loaded model from {weights} with classes {list(model.names.values())}")
+        return cls(model, weights_path=getattr(model, "ckpt_path", None) or weights, **kwargs)
+
+    @property
+    def names(self):
+        return self.model.names
+
+    @property
+    def is_custom(self):
+        return bool(self.weights_path) and os.path.basename(str(self.weights_path)) != PRETRAINED_WEIGHTS
+
+    def warmup(self, size=640):
+        """Run one dummy frame so the first real request does not pay for lazy initialisation"""
+        with self._lock:
+            self.model.predict(np.zeros((size, size, 3), dtype=np.uint8), verbose=False)
+
+    def set_memory_format(self, channels_last):
+        import torch
+
+        with self._lock:
+            self.model.model.to(memory_format=torch.channels_last if channels_last else torch.contiguous_format)
+
+    @staticmethod
+    def _to_bgr(image):
+        if isinstance(image, np.ndarray):
+            return image
+        # PIL image; Ultralytics expects numpy frames in BGR order
+        return np.asarray(image.convert("RGB"))[:, :, ::-1]
+
+    @staticmethod
+    def _size(image):
+        if isinstance(image, np.ndarray):
+            return image.shape[1], image.shape[0]
+        return image.width, image.height
+
+    @staticmethod
+    def _resize(image, size):
+        if isinstance(image, np.ndarray):
+            import cv2
+            return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        return image.resize(size)
+
+    def predict(self, image, conf=None, tiled=None):
+        """
+        Detect objects in one image; images larger than MAX_IMAGE_SIDE are
+        downscaled first and large images use tiled inference. Boxes are
+        always in the original image's coordinates.
+        """
+        conf = self.conf if conf is None else conf
+        tiled = self.tiled if tiled is None else tiled
+
+        if isinstance(image, str):
+            return self.predict_batch([image], conf=conf)[0]
+
+        width, height = self._size(image)
+        scale = min(1.0, MAX_IMAGE_SIDE / max(width, height))
+        if scale < 1.0:
+            image = self._resize(image, (max(1, round(width * scale)), max(1, round(height * scale))))
+
+        if should_tile(*self._size(image), tiled):
+            with self._lock:
+                boxes, scores, class_ids = tiled_predict(self.model, self._to_bgr(image), conf=conf)
+        else:
+            detections = self.predict_batch([image], conf=conf)[0]
+            boxes, scores, class_ids = detections.boxes, detections.scores, detections.class_ids
+
+        return Detections(boxes / scale, scores, class_ids, self.names, (width, height))
+
+    def predict_batch(self, images, conf=None):
+        """Detect objects in several images with a single model call"""
+        conf = self.conf if conf is None else conf
+        if not images:
+            return []
+        with self._lock:
+            results = self.model.predict(list(images), conf=conf, verbose=False)
+        return [Detections.from_result(result) for result in results]
+
+    def track(self, image, conf=None, persist=True):
+        """
+        Detect and track objects in the next frame of a sequence; persist=False
+        starts new tracks, as for the first frame of a video.
+        """
+        conf = self.conf if conf is None else conf
+        with self._lock:
+            results = self.model.track(image, conf=conf, persist=persist, verbose=False)
+        return Detections.from_result(results[0])
+
+    def predict_stream(self, source, conf=None, track=False, tiled=None):
+        """
+        Yield (frame_index, Detections) for a video file, stream URL or camera index.
+        track=True keeps ids across frames via model.track(); tiled="on" runs
+        motion-masked tiled inference per frame instead.
+        """
+        conf = self.conf if conf is None else conf
+        tiled = self.tiled if tiled is None else tiled
+
+        if tiled == "on":
+            for frame_index, boxes, scores, class_ids in self._locked(predict_video(self.model, source, conf=conf)):
+                yield frame_index, Detections(boxes, scores, class_ids, self.names, None)
+            return
+
+        if track:
+            results = self.model.track(source=source, conf=conf, stream=True, persist=True, verbose=False)
+        else:
+            results = self.model.predict(source=source, conf=conf, stream=True, verbose=False)
+
+        for frame_index, result in enumerate(self._locked(results)):
+            yield frame_index, Detections.from_result(result)
+
+    def _locked(self, iterator):
+        """Advance a lazy model iterator one frame at a time under the model lock"""
+        iterator = iter(iterator)
+        while True:
+            with self._lock:
+                item = next(iterator, None)
+            if item is None:
+                return
+            yield item
@@ -0,0 +1,332 @@
+"""
+Tiled Inference for High-Resolution Footage
+DDS70 Project - keep small-ball recall on wide-angle 4K frames
+
+Large frames are split into overlapping tiles that are predicted as one batch,
+together with a downscaled view of the whole frame for large objects (court,
+players close to camera). Boxes are shifted back to frame coordinates and
+merged across tile seams. Tiles that a motion or court mask marks as empty are
+skipped and at most MAX_TILES tiles are predicted per frame; without masks the
+tiles are enlarged (and downscaled to TILE_SIZE by the model) until the frame
+fits in MAX_TILES, so the per-frame cost stays bounded at any resolution.
+"""
+
+import logging
+import os
+
+import numpy as np
+
+from .boxes import box_iou
+
+logger = logging.getLogger(__name__)
+
+TILED_INFERENCE = os.environ.get("TILED_INFERENCE", "auto")  # auto, on or off
+TILE_SIZE = int(os.environ.get("TILE_SIZE", "640"))
+TILE_OVERLAP = float(os.environ.get("TILE_OVERLAP", "0.2"))
+TILE_MIN_SIDE = int(os.environ.get("TILE_MIN_SIDE", "1280"))
+MAX_TILES = int(os.environ.get("MAX_TILES", "16"))
+
+# Fraction of a tile that must be active in the mask for it to be predicted
+MIN_TILE_ACTIVITY = 0.002
+
+# Overlap needed to merge two boxes of the same class across tiles
+MERGE_THRESHOLD = 0.5
+
+# Boxes within this many pixels of an interior tile edge are treated as cut by the seam
+SEAM_MARGIN = 2
+
+# Growth factor per step when enlarging tiles to fit MAX_TILES
+TILE_GROWTH = 1.25
+
+EPS = 1e-9
+
+
+def should_tile(width, height, mode=TILED_INFERENCE):
+    """Whether a frame of this size goes through tiled inference"""
+    if mode == "on":
+        return max(width, height) > TILE_SIZE
+    if mode == "auto":
+        return max(width, height) >= TILE_MIN_SIDE
+    return False
+
+
+def _axis_starts(length, tile_size, stride):
+    if length <= tile_size:
+        return np.array([0])
+    starts = np.arange(0, length - tile_size, stride)
+    # Last tile is flush with the edge so the whole frame is covered
+    return np.append(starts, length - tile_size)
+
+
+def make_tiles(width, height, tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    """Return an (N, 4) array of overlapping xyxy tile windows covering the frame"""
+    stride = max(1, int(tile_size * (1 - overlap)))
+    xs = _axis_starts(width, tile_size, stride)
+    ys = _axis_starts(height, tile_size, stride)
+    x0, y0 = np.meshgrid(xs, ys)
+    x0, y0 = x0.ravel(), y0.ravel()
+    return np.stack([
+        x0, y0,
+        np.minimum(x0 + tile_size, width),
+        np.minimum(y0 + tile_size, height),
+    ], axis=1)
+
+
+def tile_activity(mask, tiles, frame_shape):
+    """
+    Fraction of each tile that is active in a boolean mask.
+    The mask may be lower resolution than the frame; sums use an integral image
+    so the cost does not depend on the number of tiles.
+    """
+    mask_h, mask_w = mask.shape[:2]
+    frame_h, frame_w = frame_shape[:2]
+
+    integral = np.zeros((mask_h + 1, mask_w + 1), dtype=np.int64)
+    integral[1:, 1:] = mask.astype(np.int64).cumsum(0).cumsum(1)
+
+    scale = np.array([mask_w / frame_w, mask_h / frame_h, mask_w / frame_w, mask_h / frame_h])
+    t = np.round(tiles * scale).astype(np.int64)
+    x0, y0 = t[:, 0], t[:, 1]
+    x1 = np.maximum(t[:, 2], x0 + 1).clip(max=mask_w)
+    y1 = np.maximum(t[:, 3], y0 + 1).clip(max=mask_h)
+
+    active = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+    return active / ((x1 - x0) * (y1 - y0))
+
+
+def fit_tile_size(width, height, tile_size=TILE_SIZE, overlap=TILE_OVERLAP, max_tiles=MAX_TILES):
+    """Smallest tile size, starting from tile_size, whose tiling of the frame has at most max_tiles tiles"""
+    max_tiles = max(1, max_tiles)
+    while len(make_tiles(width, height, tile_size, overlap)) > max_tiles:
+        tile_size = int(np.ceil(tile_size * TILE_GROWTH))
+    return tile_size
+
+
+def select_tiles(tiles, frame_shape, masks=None, max_tiles=MAX_TILES, min_activity=MIN_TILE_ACTIVITY):
+    """
+    Drop tiles that the masks mark as empty and keep at most max_tiles of the busiest ones.
+    Without masks every tile is kept so still images are fully covered; size
+    the tiles with fit_tile_size() to bound their number.
+    """
+    if not masks:
+        return tiles
+
+    combined = masks[0]
+    for mask in masks[1:]:
+        if mask.shape != combined.shape:
+            raise ValueError("all masks must share one resolution")
+        combined = combined & mask
+    activity = tile_activity(combined, tiles, frame_shape)
+
+    order = np.argsort(-activity, kind="stable")
+    order = order[activity[order] >= min_activity][:max_tiles]
+    return tiles[np.sort(order)]
+
+
+def _pairwise_overlap(boxes, cut):
+    """
+    IoU between all pairs; pairs where either box is cut by a tile seam use
+    intersection over the smaller box instead, so a partial box matches the
+    whole one. Overlapping but separate objects (occluding players) keep IoU.
+    """
+    overlap = box_iou(boxes, boxes)
+    if cut is None or not cut.any():
+        return overlap
+
+    area = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    top_left = np.maximum(boxes[:, None, :2], boxes[None, :, :2])
+    bottom_right = np.minimum(boxes[:, None, 2:], boxes[None, :, 2:])
+    inter = np.clip(bottom_right - top_left, 0, None).prod(axis=2)
+    ios = inter / (np.minimum(area[:, None], area[None, :]) + EPS)
+
+    seam_pairs = cut[:, None] | cut[None, :]
+    overlap[seam_pairs] = ios[seam_pairs]
+    return overlap
+
+
+def seam_cut(boxes, tile, width, height, margin=SEAM_MARGIN):
+    """Which boxes (frame coordinates) touch an edge of their tile that lies inside the frame"""
+    x0, y0, x1, y1 = tile
+    return (
+        ((x0 > 0) & (boxes[:, 0] <= x0 + margin))
+        | ((y0 > 0) & (boxes[:, 1] <= y0 + margin))
+        | ((x1 < width) & (boxes[:, 2] >= x1 - margin))
+        | ((y1 < height) & (boxes[:, 3] >= y1 - margin))
+    )
+
+
+def merge_detections(boxes, scores, classes, method="nms", cut=None, threshold=MERGE_THRESHOLD):
+    """
+    Class-aware merge of overlapping detections.
+
+    The overlap matrix is computed once; each surviving box then absorbs its
+    group with one vector operation. "nms" keeps the highest scoring box of a
+    group, "wbf" replaces it with the confidence-weighted mean of the group.
+    cut marks boxes truncated by a tile seam (see seam_cut); a group with a
+    cut member takes its best uncut box, or the union of the pieces when all
+    members are cut, with the group's top score.
+    """
+    if len(boxes) == 0:
+        return boxes, scores, classes
+
+    order = np.argsort(-scores)
+    boxes, scores, classes = boxes[order], scores[order], classes[order]
+    cut = cut[order] if cut is not None else None
+
+    overlap = _pairwise_overlap(boxes, cut)
+    overlap[classes[:, None] != classes[None, :]] = 0
+
+    absorbed = np.zeros(len(boxes), dtype=bool)
+    keep = []
+    merged_boxes = boxes.copy()
+    for i in range(len(boxes)):
+        if absorbed[i]:
+            continue
+        group = ~absorbed & (overlap[i] >= threshold)
+        group[i] = True
+        absorbed |= group
+        keep.append(i)
+
+        if cut is not None and cut[group].any() and group.sum() > 1:
+            # Seam group: the top score may belong to a truncated piece, so take
+            # the best whole box, or the union of the pieces if all are cut
+            whole = group & ~cut
+            if whole.any():
+                merged_boxes[i] = boxes[np.argmax(np.where(whole, scores, -np.inf))]
+            else:
+                members = boxes[group]
+                merged_boxes[i] = np.concatenate([members[:, :2].min(0), members[:, 2:].max(0)])
+        elif method == "wbf" and group.sum() > 1:
+            weights = scores[group]
+            merged_boxes[i] = (boxes[group] * weights[:, None]).sum(0) / weights.sum()
+
+    keep = np.array(keep)
+    return merged_boxes[keep], scores[keep], classes[keep]
+
+
+def _boxes_to_numpy(result):
+    boxes = result.boxes
+    return (
+        boxes.xyxy.cpu().numpy().astype(np.float32),
+        boxes.conf.cpu().numpy().astype(np.float32),
+        boxes.cls.cpu().numpy().astype(np.int64),
+    )
+
+
+def tiled_predict(model, frame, conf=0.25, masks=None, tile_size=TILE_SIZE, overlap=TILE_OVERLAP,
+                  max_tiles=MAX_TILES, include_full_frame=True, method="nms"):
+    """
+    Run tiled inference on a BGR frame (H, W, 3).
+    Returns (boxes xyxy, scores, class ids) in frame coordinates.
+    """
+    height, width = frame.shape[:2]
+    crop_size = tile_size
+    if not masks:
+        # Nothing to skip tiles by: enlarge them instead, the model downscales each to tile_size
+        crop_size = fit_tile_size(width, height, tile_size, overlap, max_tiles)
+    tiles = make_tiles(width, height, crop_size, overlap)
+    tiles = select_tiles(tiles, frame.shape, masks, max_tiles)
+
+    crops = [frame[y0:y1, x0:x1] for x0, y0, x1, y1 in tiles]
+    if include_full_frame:
+        crops.append(frame)
+    if not crops:
+        empty = np.zeros((0, 4), dtype=np.float32)
+        return empty, np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+
+    # All tiles in one batch
+    results = model.predict(crops, conf=conf, imgsz=tile_size, verbose=False)
+
+    windows = list(tiles)
+    if include_full_frame:
+        windows.append(np.array([0, 0, width, height]))
+    all_boxes, all_scores, all_classes, all_cut = [], [], [], []
+    for result, window in zip(results, windows):
+        boxes, scores, classes = _boxes_to_numpy(result)
+        boxes[:, [0, 2]] += window[0]
+        boxes[:, [1, 3]] += window[1]
+        all_boxes.append(boxes)
+        all_scores.append(scores)
+        all_classes.append(classes)
+        all_cut.append(seam_cut(boxes, window, width, height))
+
+    return merge_detections(
+        np.concatenate(all_boxes), np.concatenate(all_scores), np.concatenate(all_classes),
+        method=method, cut=np.concatenate(all_cut),
+    )
+
+
+class MotionMask:
+    """
+    Cheap frame-difference motion mask for video.
+    Works on a strided grayscale thumbnail, so it costs far less than a tile.
+    """
+
+    def __init__(self, stride=8, threshold=25, dilate=2):
+        self.stride = stride
+        self.threshold = threshold
+        self.dilate = dilate
+        self._previous = None
+
+    def update(self, frame):
+        """Return the motion mask for this frame, or None for the first frame"""
+        thumb = frame[::self.stride, ::self.stride].mean(axis=2).astype(np.int16)
+        previous, self._previous = self._previous, thumb
+        if previous is None or previous.shape != thumb.shape:
+            return None
+
+        mask = np.abs(thumb - previous) > self.threshold
+        # Grow the mask a little so a moving ball near a tile edge keeps its tile
+        for _ in range(self.dilate):
+            grown = mask.copy()
+            grown[1:] |= mask[:-1]
+            grown[:-1] |= mask[1:]
+            grown[:, 1:] |= mask[:, :-1]
+            grown[:, :-1] |= mask[:, 1:]
+            mask = grown
+        return mask
+
+
+def predict_video(model, source, conf=0.25, court_mask=None, tile_size=TILE_SIZE,
+                  overlap=TILE_OVERLAP, max_tiles=MAX_TILES, use_motion=True):
+    """
+    Tiled inference over a video file or camera index.
+    Yields (frame_index, boxes, scores, class ids) per frame. court_mask is an
+    optional boolean array (any resolution) marking the playing area.
+    """
+    import cv2
+
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        raise IOError(f"Could not open video source {source}")
+
+    motion = MotionMask() if use_motion else None
+    frame_index = 0
+    try:
+        while True:
+            success, frame = cap.read()
+            if not success:
+                break
+
+            masks = []
+            if motion is not None:
+                motion_mask = motion.update(frame)
+                if motion_mask is not None:
+                    masks.append(motion_mask)
+            if court_mask is not None:
+                if masks:
+                    h, w = masks[0].shape
+                    ys = np.linspace(0, court_mask.shape[0] - 1, h).astype(int)
+                    xs = np.linspace(0, court_mask.shape[1] - 1, w).astype(int)
+                    masks.append(court_mask[ys][:, xs])
+                else:
+                    masks.append(court_mask)
+
+            boxes, scores, classes = tiled_predict(
+                model, frame, conf=conf, masks=masks, tile_size=tile_size,
+                overlap=overlap, max_tiles=max_tiles,
+            )
+            yield frame_index, boxes, scores, classes
+            frame_index += 1
+    finally:
+        cap.release()
@@ -0,0 +1,335 @@
+"""
+Video Frame Index and Detection Cache
+DDS70 Project - scrub the same game recording without re-decoding or re-detecting
+
+VideoIndex keeps a sidecar index of keyframe positions per video (keyed by a
+content fingerprint), so seeking to any frame decodes only from the nearest
+preceding keyframe. CachedVideoAnalyzer stores detections in fixed-size frame
+chunks keyed by video, chunk, model version and inference options; re-analysing
+a range serves cached chunks directly and only sends new chunks through the
+detector. Tracked runs also store track ids; since tracker state depends on
+every earlier frame, a missing chunk is tracked by replaying the video from the
+start (consecutive chunks continue the same run).
+
+Keyframe-accurate seeking uses PyAV when installed; otherwise OpenCV's own
+frame seeking is used and the index holds only fps and frame count.
+
+    video_cache/<video_hash>/index.npz
+    video_cache/<video_hash>/<model_version>-conf<conf>-tiled<mode>[-track]/chunk_<start>.npz
+"""
+
+import hashlib
+import logging
+import os
+
+import numpy as np
+
+from .detector import Detections, weights_hash
+from .tiling import should_tile
+
+logger = logging.getLogger(__name__)
+
+VIDEO_CACHE_DIR = os.environ.get("VIDEO_CACHE_DIR", "video_cache")
+
+# Frames per cached detection chunk
+CHUNK_FRAMES = 256
+
+# Frames decoded and predicted per model call
+BATCH_FRAMES = 16
+
+# Track id stored for detections the tracker did not assign
+NO_TRACK = -1
+
+FINGERPRINT_BLOCK = 1 << 20
+
+try:
+    import av
+    PYAV_AVAILABLE = True
+except ImportError:
+    av = None
+    PYAV_AVAILABLE = False
+
+
+def video_fingerprint(path):
+    """
+    Content hash of a video from its size and three sampled 1 MB blocks.
+    Hashing a multi-GB recording in full on every run would cost more than the seek it saves.
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.sha256(str(size).encode())
+    with open(path, "rb") as f:
+        for offset in (0, max(0, size // 2 - FINGERPRINT_BLOCK // 2), max(0, size - FINGERPRINT_BLOCK)):
+            f.seek(offset)
+            digest.update(f.read(FINGERPRINT_BLOCK))
+    return digest.hexdigest()[:16]
+
+
+class VideoIndex:
+    """Keyframe index for one video file, built once and stored by fingerprint"""
+
+    def __init__(self, path, cache_dir=VIDEO_CACHE_DIR):
+        self.path = path
+        self.video_hash = video_fingerprint(path)
+        self.directory = os.path.join(cache_dir, self.video_hash)
+        self.index_path = os.path.join(self.directory, "index.npz")
+
+        self.fps = None
+        self.frame_count = None
+        self.keyframes = np.zeros(0, dtype=np.int64)      # frame numbers
+        self.keyframe_pts = np.zeros(0, dtype=np.int64)   # stream pts of those frames
+        self.start_pts = 0
+        self.time_base = None
+
+        if not self._load():
+            self.build()
+
+    def _load(self):
+        if not os.path.exists(self.index_path):
+            return False
+        with np.load(self.index_path) as data:
+            self.fps = float(data["fps"])
+            self.frame_count = int(data["frame_count"])
+            self.keyframes = data["keyframes"]
+            self.keyframe_pts = data["keyframe_pts"]
+            self.start_pts = int(data["start_pts"])
+            self.time_base = float(data["time_base"]) if data["time_base"] > 0 else None
+        return True
+
+    def build(self):
+        """Scan the container for keyframes (packet flags only, no decoding)"""
+        if PYAV_AVAILABLE:
+            with av.open(self.path) as container:
+                stream = container.streams.video[0]
+                self.fps = float(stream.average_rate)
+                self.time_base = float(stream.time_base)
+                self.start_pts = stream.start_time or 0
+
+                pts = []
+                count = 0
+                for packet in container.demux(stream):
+                    if packet.pts is None:
+                        continue
+                    count += 1
+                    if packet.is_keyframe:
+                        pts.append(packet.pts)
+
+                self.frame_count = stream.frames or count
+                self.keyframe_pts = np.array(sorted(pts), dtype=np.int64)
+                self.keyframes = self._pts_to_frame(self.keyframe_pts)
+        else:
+            import cv2
+
+            cap = cv2.VideoCapture(self.path)
+            self.fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+            self.frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            cap.release()
+
+        os.makedirs(self.directory, exist_ok=True)
+        np.savez(
+            self.index_path,
+            fps=self.fps,
+            frame_count=self.frame_count,
+            keyframes=self.keyframes,
+            keyframe_pts=self.keyframe_pts,
+            start_pts=self.start_pts,
+            time_base=self.time_base or 0.0,
+        )
+        logger.info(f"Indexed {self.path}: {self.frame_count} frames, {len(self.keyframes)} keyframes")
+
+    def _pts_to_frame(self, pts):
+        return np.round((np.asarray(pts) - self.start_pts) * self.time_base * self.fps).astype(np.int64)
+
+    def frame_at(self, timestamp):
+        return int(round(timestamp * self.fps))
+
+    def nearest_keyframe(self, frame):
+        """Index into keyframes of the last keyframe at or before frame, or None without an index"""
+        if not len(self.keyframes):
+            return None
+        return max(0, int(np.searchsorted(self.keyframes, frame, side="right")) - 1)
+
+    def frames(self, start, end, status=None):
+        """
+        Yield (frame_index, BGR frame) for start <= frame_index < end, decoding
+        from the nearest keyframe. The container's frame count is only an
+        estimate, so decoding runs until end or until the decoder runs out.
+        status["complete"] is set when the decoder got past end, status["eof"]
+        when it reached the end of the video.
+        """
+        status = {} if status is None else status
+        status.update(complete=False, eof=False)
+        if start >= end:
+            return
+
+        keyframe = self.nearest_keyframe(start)
+        if PYAV_AVAILABLE and keyframe is not None:
+            with av.open(self.path) as container:
+                stream = container.streams.video[0]
+                container.seek(int(self.keyframe_pts[keyframe]), stream=stream, backward=True, any_frame=False)
+                for frame in container.decode(stream):
+                    if frame.pts is None:
+                        continue
+                    index = int(self._pts_to_frame(frame.pts))
+                    if index < start:
+                        continue
+                    if index >= end:
+                        status["complete"] = True
+                        return
+                    yield index, frame.to_ndarray(format="bgr24")
+            status["eof"] = True
+            return
+
+        import cv2
+
+        cap = cv2.VideoCapture(self.path)
+        try:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+            for index in range(start, end):
+                success, frame = cap.read()
+                if not success:
+                    # A frame that fails to decode mid-file is not the end of the video
+                    status["eof"] = not cap.grab()
+                    return
+                yield index, frame
+            status["complete"] = True
+        finally:
+            cap.release()
+
+
+class CachedVideoAnalyzer:
+    """
+    Detections for frame ranges of one video, cached per model version and
+    options. Only chunks that were never analysed with these settings reach
+    the detector. track=True keeps ids across frames via Detector.track(), so
+    the detector's tracker should not be shared while the analyzer runs;
+    tiled (auto, on, off; default from the detector) cannot be combined with
+    tracking.
+    """
+
+    def __init__(self, detector, path, model_version=None, cache_dir=VIDEO_CACHE_DIR, tiled=None, track=False):
+        tiled = detector.tiled if tiled is None else tiled
+        if track and tiled == "on":
+            raise ValueError("tracked analysis does not support tiled inference")
+        self.detector = detector
+        self.tiled = "off" if track else tiled
+        self.track = track
+        self.index = VideoIndex(path, cache_dir)
+        if model_version is None:
+            model_version = weights_hash(detector.weights_path)[:12] if detector.weights_path else "unknown"
+        self.model_version = model_version
+        self.stats = {"cached_chunks": 0, "analysed_chunks": 0}
+        # (conf, next chunk start) the detector's tracker is positioned at
+        self._track_position = None
+
+    def _chunk_path(self, chunk_start, conf):
+        options = f"{self.model_version}-conf{conf:g}-tiled{self.tiled}{'-track' if self.track else ''}"
+        directory = os.path.join(self.index.directory, options)
+        return os.path.join(directory, f"chunk_{chunk_start:09d}.npz")
+
+    def _analyse_chunk(self, chunk_start, conf):
+        """
+        Decode one chunk from its nearest keyframe, detect in batches and store it.
+        A chunk where decoding stopped early is only stored when the decoder
+        reached the end of the video; otherwise it is returned uncached.
+        """
+        frames, boxes, scores, class_ids, track_ids = [], [], [], [], []
+        batch = []
+        status = {}
+
+        def flush():
+            images = [image for _, image in batch]
+            height, width = images[0].shape[:2]
+            if self.track:
+                # The first frame of the video starts new tracks
+                results = [self.detector.track(image, conf=conf, persist=index > 0) for index, image in batch]
+            elif should_tile(width, height, self.tiled):
+                results = [self.detector.predict(image, conf=conf, tiled=self.tiled) for image in images]
+            else:
+                results = self.detector.predict_batch(images, conf=conf)
+            for (index, _), detections in zip(batch, results):
+                frames.append(np.full(len(detections), index, dtype=np.int64))
+                boxes.append(detections.boxes)
+                scores.append(detections.scores)
+                class_ids.append(detections.class_ids)
+                if detections.track_ids is not None:
+                    track_ids.append(detections.track_ids)
+                else:
+                    track_ids.append(np.full(len(detections), NO_TRACK, dtype=np.int64))
+            batch.clear()
+
+        for index, image in self.index.frames(chunk_start, chunk_start + CHUNK_FRAMES, status):
+            batch.append((index, image))
+            if len(batch) == BATCH_FRAMES:
+                flush()
+        if batch:
+            flush()
+
+        chunk = {
+            "frame": np.concatenate(frames) if frames else np.zeros(0, dtype=np.int64),
+            "boxes": np.concatenate(boxes) if boxes else np.zeros((0, 4), dtype=np.float32),
+            "scores": np.concatenate(scores) if scores else np.zeros(0, dtype=np.float32),
+            "class_ids": np.concatenate(class_ids) if class_ids else np.zeros(0, dtype=np.int64),
+            "eof": np.array(status["eof"]),
+        }
+        if self.track:
+            chunk["track_ids"] = np.concatenate(track_ids) if track_ids else np.zeros(0, dtype=np.int64)
+            self._track_position = (conf, chunk_start + CHUNK_FRAMES)
+
+        if not status["complete"] and not status["eof"]:
+            logger.warning(f"Decoding stopped early in chunk at frame {chunk_start}; not caching it")
+            self.stats["analysed_chunks"] += 1
+            self._track_position = None
+            return chunk
+
+        path = self._chunk_path(chunk_start, conf)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp.npz"
+        np.savez_compressed(tmp_path, **chunk)
+        os.replace(tmp_path, path)
+        self.stats["analysed_chunks"] += 1
+        return chunk
+
+    def _chunk(self, chunk_start, conf):
+        path = self._chunk_path(chunk_start, conf)
+        if os.path.exists(path):
+            self.stats["cached_chunks"] += 1
+            with np.load(path) as data:
+                return {name: data[name] for name in data.files}
+        if self.track and self._track_position != (conf, chunk_start):
+            # Tracker state depends on every earlier frame, so replay up to this chunk
+            for earlier in range(0, chunk_start, CHUNK_FRAMES):
+                if self._analyse_chunk(earlier, conf).get("eof", False) or self._track_position is None:
+                    break
+        return self._analyse_chunk(chunk_start, conf)
+
+    def detections(self, start, end, conf=None):
+        """Yield (frame_index, Detections) for start <= frame_index < end"""
+        conf = self.detector.conf if conf is None else conf
+        first_chunk = start - start % CHUNK_FRAMES
+        for chunk_start in range(first_chunk, end, CHUNK_FRAMES):
+            chunk = self._chunk(chunk_start, conf)
+            frame_column = chunk["frame"]
+            lo = int(np.searchsorted(frame_column, start, side="left"))
+            hi = int(np.searchsorted(frame_column, end, side="left"))
+            bounds = np.flatnonzero(np.diff(frame_column[lo:hi])) + 1 + lo
+
+            # Frames with no detections are simply absent from the chunk
+            for group_lo, group_hi in zip(np.concatenate([[lo], bounds]), np.concatenate([bounds, [hi]])):
+                if group_lo == group_hi:
+                    continue
+                yield int(frame_column[group_lo]), Detections(
+                    chunk["boxes"][group_lo:group_hi],
+                    chunk["scores"][group_lo:group_hi],
+                    chunk["class_ids"][group_lo:group_hi],
+                    self.detector.names,
+                    None,
+                    chunk["track_ids"][group_lo:group_hi] if "track_ids" in chunk else None,
+                )
+
+            # Nothing is left to decode past the end of the video
+            if chunk.get("eof", False):
+                break
+
+    def detections_between(self, start_time, end_time, conf=None):
+        """Same as detections() with the range given in seconds"""
+        return self.detections(self.index.frame_at(start_time), self.index.frame_at(end_time), conf)
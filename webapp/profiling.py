@@ -0,0 +1,290 @@
+"""
+On-Demand Request Profiling
+DDS70 Project - flame profiles for individual requests in the live service
+
+A request is profiled when it carries "X-Profile: 1" together with a valid
+admin token, or when it is picked by the sampling rate (PROFILE_SAMPLE_RATE,
+adjustable at runtime). A profile holds:
+
+- a sampling profile of the request thread in folded-stack format
+  (same format as `py-spy record --format raw`; open with speedscope or
+  flamegraph.pl), or a cProfile .prof file when mode is "cprofile"
+- torch operator timings, when torch is available; the torch profiler is
+  process-wide, so overlapping profiled requests after the first skip them
+
+Profiles are written to PROFILE_DIR and the oldest are deleted beyond
+PROFILE_RING entries. When profiling is off, the per-request cost is one header
+lookup and one random draw.
+"""
+
+import cProfile
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_RING = int(os.environ.get("PROFILE_RING", "50"))
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", "0.005"))
+
+PROFILE_MODES = ("sample", "cprofile")
+
+# Torch operators reported per profile
+TOP_TORCH_OPS = 25
+
+# torch.profiler (Kineto) is process-wide, so only one request at a time records torch ops
+_torch_profiler_lock = threading.Lock()
+
+# Range recorded around the profiled block; its events carry the profiled thread's id
+TORCH_PROFILE_RANGE = "request_profile"
+
+
+class StackSampler:
+    """Samples one thread's Python stack at a fixed interval and counts folded stacks"""
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="profile-sampler")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def folded(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+@contextmanager
+def _torch_profiler():
+    """
+    Torch operator profiler, or a no-op yielding None when torch is missing,
+    another request is already being profiled, or the profiler fails to start.
+    """
+    try:
+        from torch.profiler import ProfilerActivity, profile, record_function
+    except ImportError:
+        yield None
+        return
+
+    if not _torch_profiler_lock.acquire(blocking=False):
+        yield None
+        return
+
+    try:
+        prof = profile(activities=[ProfilerActivity.CPU])
+        try:
+            prof.start()
+        except Exception as e:
+            logger.warning(f"Torch profiler failed to start: {e}")
+            prof = None
+
+        try:
+            with record_function(TORCH_PROFILE_RANGE) if prof is not None else nullcontext():
+                yield prof
+        finally:
+            if prof is not None:
+                try:
+                    prof.stop()
+                except Exception as e:
+                    logger.warning(f"Torch profiler failed to stop: {e}")
+    finally:
+        _torch_profiler_lock.release()
+
+
+def _torch_op_table(prof):
+    """
+    Top operators by self CPU time, counting only events recorded on the
+    profiled thread; the torch profiler itself sees every thread in the process.
+    """
+    events = prof.events()
+    threads = {event.thread for event in events if event.key == TORCH_PROFILE_RANGE}
+    totals = {}
+    for event in events:
+        if event.thread not in threads or event.key == TORCH_PROFILE_RANGE:
+            continue
+        count, self_cpu, cpu_total = totals.get(event.key, (0, 0.0, 0.0))
+        totals[event.key] = (count + 1, self_cpu + event.self_cpu_time_total, cpu_total + event.cpu_time_total)
+
+    ranked = sorted(totals.items(), key=lambda item: item[1][1], reverse=True)
+    return [
+        {
+            "op": key,
+            "count": count,
+            "self_cpu_ms": round(self_cpu / 1000, 3),
+            "cpu_total_ms": round(cpu_total / 1000, 3),
+        }
+        for key, (count, self_cpu, cpu_total) in ranked[:TOP_TORCH_OPS]
+    ]
+
+
+class ProfileStore:
+    """Bounded ring of profiles on disk: <id>.json metadata plus .folded or .prof data"""
+
+    def __init__(self, root=PROFILE_DIR, capacity=PROFILE_RING):
+        self.root = root
+        self.capacity = capacity
+        self._lock = threading.Lock()
+
+    def _meta_paths(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(os.path.join(self.root, f) for f in os.listdir(self.root) if f.endswith(".json"))
+
+    def save(self, profile_id, meta, data_suffix, write_data):
+        os.makedirs(self.root, exist_ok=True)
+        write_data(os.path.join(self.root, f"{profile_id}{data_suffix}"))
+        with open(os.path.join(self.root, f"{profile_id}.json"), "w") as f:
+            json.dump(meta, f, indent=2)
+
+        with self._lock:
+            meta_paths = self._meta_paths()
+            # Ids start with a millisecond timestamp, so name order is age order
+            for path in meta_paths[:max(0, len(meta_paths) - self.capacity)]:
+                stem = path[:-len(".json")]
+                for suffix in (".json", ".folded", ".prof"):
+                    try:
+                        os.remove(stem + suffix)
+                    except FileNotFoundError:
+                        pass
+
+    def list(self):
+        profiles = []
+        for path in reversed(self._meta_paths()):
+            try:
+                with open(path) as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            meta.pop("torch_ops", None)
+            profiles.append(meta)
+        return profiles
+
+    def get(self, profile_id):
+        with open(os.path.join(self.root, f"{profile_id}.json")) as f:
+            return json.load(f)
+
+    def data_path(self, profile_id):
+        """Path of the profile's sampling or cProfile data file, or None"""
+        for suffix in (".folded", ".prof"):
+            path = os.path.join(self.root, f"{profile_id}{suffix}")
+            if os.path.exists(path):
+                return path
+        return None
+
+
+class RequestProfiler:
+    """Decides which requests to profile and records them into the store"""
+
+    def __init__(self, store=None, sample_rate=PROFILE_SAMPLE_RATE, mode="sample"):
+        self.store = store or ProfileStore()
+        self.sample_rate = sample_rate
+        self.mode = mode
+
+    def configure(self, sample_rate=None, mode=None):
+        if sample_rate is not None:
+            if not 0.0 <= sample_rate <= 1.0:
+                raise ValueError("sample_rate must be between 0 and 1")
+            self.sample_rate = sample_rate
+        if mode is not None:
+            if mode not in PROFILE_MODES:
+                raise ValueError(f"mode must be one of {PROFILE_MODES}")
+            self.mode = mode
+        return {"sample_rate": self.sample_rate, "mode": self.mode}
+
+    def should_profile(self, requested):
+        return requested or (self.sample_rate > 0 and random.random() < self.sample_rate)
+
+    @contextmanager
+    def profile(self, label, mode=None):
+        """
+        Profile the body of the with-block on the current thread.
+        Yields a dict whose "id" is set once the profile has been saved.
+        """
+        mode = mode if mode in PROFILE_MODES else self.mode
+        profile_id = f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:6]}"
+        handle = {"id": None}
+
+        sampler = None
+        cprofiler = None
+        if mode == "cprofile":
+            cprofiler = cProfile.Profile()
+        else:
+            sampler = StackSampler(threading.get_ident())
+
+        start = time.time()
+        with _torch_profiler() as torch_prof:
+            if cprofiler:
+                try:
+                    cprofiler.enable()
+                except ValueError as e:
+                    # Python 3.12+ allows one cProfile at a time per process
+                    logger.warning(f"cProfile unavailable ({e}); sampling instead")
+                    cprofiler = None
+                    mode = "sample"
+                    sampler = StackSampler(threading.get_ident())
+            if sampler:
+                sampler.start()
+            try:
+                yield handle
+            finally:
+                if cprofiler:
+                    cprofiler.disable()
+                if sampler:
+                    sampler.stop()
+        duration = time.time() - start
+
+        meta = {
+            "id": profile_id,
+            "label": label,
+            "mode": mode,
+            "started_at": start,
+            "duration_ms": round(duration * 1000, 1),
+        }
+        if sampler:
+            meta["samples"] = sampler.samples
+        if torch_prof is not None:
+            try:
+                meta["torch_ops"] = _torch_op_table(torch_prof)
+            except Exception as e:
+                logger.warning(f"Could not read torch profiler results: {e}")
+
+        try:
+            if sampler:
+                def write_data(path):
+                    with open(path, "w") as f:
+                        f.write(sampler.folded())
+                self.store.save(profile_id, meta, ".folded", write_data)
+            else:
+                self.store.save(profile_id, meta, ".prof", cprofiler.dump_stats)
+            handle["id"] = profile_id
+        except OSError as e:
+            logger.error(f"Error saving profile {profile_id}: {e}")
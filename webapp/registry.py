@@ -0,0 +1,384 @@
+"""
+Versioned Model Registry and Hot Reload
+DDS70 Project - swap weights without redeploying the container
+
+Weights are stored in MODEL_REGISTRY_DIR as <version>.pt, where the version is
+the leading part of the file's sha256. registry.json records which version is
+active and an optional rollout candidate (shadow or canary). The manager loads
+and warms new versions in a background thread and swaps them in atomically;
+requests that already picked up the old model keep their reference and finish
+on it.
+"""
+
+import json
+import logging
+import os
+import random
+import shutil
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from inference import box_iou, weights_hash
+
+logger = logging.getLogger(__name__)
+
+REGISTRY_DIR = os.environ.get("MODEL_REGISTRY_DIR", "models")
+WATCH_INTERVAL = float(os.environ.get("MODEL_WATCH_INTERVAL", "0"))
+
+MANIFEST_NAME = "registry.json"
+VERSION_LENGTH = 12
+ROLLOUT_MODES = ("shadow", "canary")
+
+# IoU needed for two detections of the same class to count as agreeing
+AGREEMENT_IOU = 0.5
+
+
+class ModelRegistry:
+    """Content-addressed store of weight files plus a small JSON manifest"""
+
+    def __init__(self, root=REGISTRY_DIR):
+        self.root = root
+        self.manifest_path = os.path.join(root, MANIFEST_NAME)
+        self._lock = threading.Lock()
+
+    def read(self):
+        """Return the manifest, or an empty one if the registry is new"""
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"versions": {}, "active": None, "rollout": None}
+
+    def _write(self, manifest):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def mtime(self):
+        try:
+            return os.path.getmtime(self.manifest_path)
+        except OSError:
+            return None
+
+    def path(self, version):
+        return os.path.join(self.root, f"{version}.pt")
+
+    def register(self, source_path, note=None):
+        """Copy a weights file into the registry and return its version"""
+        digest = weights_hash(source_path)
+        version = digest[:VERSION_LENGTH]
+
+        with self._lock:
+            manifest = self.read()
+            target = self.path(version)
+            if not os.path.exists(target):
+                os.makedirs(self.root, exist_ok=True)
+                tmp_path = target + ".tmp"
+                shutil.copyfile(source_path, tmp_path)
+                os.replace(tmp_path, target)
+
+            if version not in manifest["versions"]:
+                manifest["versions"][version] = {
+                    "sha256": digest,
+                    "source": os.path.abspath(source_path),
+                    "note": note,
+                    "registered_at": time.time(),
+                }
+                self._write(manifest)
+                logger.info(f"Registered model version {version} from {source_path}")
+
+        return version
+
+    def set_active(self, version):
+        with self._lock:
+            manifest = self.read()
+            if version not in manifest["versions"]:
+                raise KeyError(version)
+            manifest["active"] = version
+            rollout = manifest.get("rollout")
+            if rollout and rollout["version"] == version:
+                manifest["rollout"] = None
+            self._write(manifest)
+
+    def set_rollout(self, version, mode, fraction):
+        if mode not in ROLLOUT_MODES:
+            raise ValueError(f"mode must be one of {ROLLOUT_MODES}")
+        if not 0.0 <= fraction <= 1.0:
+            raise ValueError("fraction must be between 0 and 1")
+
+        with self._lock:
+            manifest = self.read()
+            if version not in manifest["versions"]:
+                raise KeyError(version)
+            manifest["rollout"] = {"version": version, "mode": mode, "fraction": fraction}
+            self._write(manifest)
+
+    def clear_rollout(self):
+        with self._lock:
+            manifest = self.read()
+            manifest["rollout"] = None
+            self._write(manifest)
+
+
+def detection_agreement(detections_a, detections_b):
+    """
+    Fraction of detections two models agree on (same class, IoU >= AGREEMENT_IOU),
+    as 2 * matches / (len(a) + len(b)). Two empty results agree fully.
+    """
+    total = len(detections_a) + len(detections_b)
+    if total == 0:
+        return 1.0
+    if not detections_a or not detections_b:
+        return 0.0
+
+    iou = box_iou([d["bbox"] for d in detections_a], [d["bbox"] for d in detections_b])
+    same_class = np.array([d["class"] for d in detections_a])[:, None] == np.array([d["class"] for d in detections_b])[None, :]
+    iou = iou * same_class
+
+    matched = 0
+    while True:
+        i, j = np.unravel_index(iou.argmax(), iou.shape)
+        if iou[i, j] < AGREEMENT_IOU:
+            break
+        matched += 1
+        iou[i, :] = 0
+        iou[:, j] = 0
+
+    return 2 * matched / total
+
+
+class RolloutStats:
+    """Per-version latency and shadow agreement over a sliding window"""
+
+    def __init__(self, window=500):
+        self.window = window
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._agreement = {}
+        self._requests = {}
+        self.shadow_skipped = 0
+        self.shadow_errors = 0
+
+    def record_latency(self, version, seconds):
+        with self._lock:
+            self._latency.setdefault(version, deque(maxlen=self.window)).append(seconds)
+            self._requests[version] = self._requests.get(version, 0) + 1
+
+    def record_agreement(self, version, agreement):
+        with self._lock:
+            self._agreement.setdefault(version, deque(maxlen=self.window)).append(agreement)
+
+    def summary(self):
+        with self._lock:
+            report = {}
+            for version, latencies in self._latency.items():
+                values = np.array(latencies) * 1000
+                entry = {
+                    "requests": self._requests[version],
+                    "latency_ms": {
+                        "mean": round(float(values.mean()), 1),
+                        "p50": round(float(np.percentile(values, 50)), 1),
+                        "p95": round(float(np.percentile(values, 95)), 1),
+                    },
+                }
+                if self._agreement.get(version):
+                    entry["agreement"] = round(float(np.mean(self._agreement[version])), 4)
+                report[version] = entry
+            return {"versions": report, "shadow_skipped": self.shadow_skipped, "shadow_errors": self.shadow_errors}
+
+
+class ModelManager:
+    """
+    Keeps the active model and an optional rollout candidate in sync with the registry.
+
+    loader(path) builds a Detector from a weights file; on_swap(version, model, path)
+    is called after a new active model has been warmed up and swapped in.
+    """
+
+    def __init__(self, registry, loader, on_swap=None):
+        self.registry = registry
+        self.loader = loader
+        self.on_swap = on_swap
+        self.stats = RolloutStats()
+
+        # (version, model) tuples, replaced as a whole so readers never see a half swap
+        self._active = None
+        self._candidate = None
+        self._rollout = None
+
+        self._loading = set()
+        self._lock = threading.Lock()
+        self._shadow_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shadow")
+        self._shadow_busy = threading.Semaphore(1)
+        self._watch_mtime = None
+
+    @property
+    def active_version(self):
+        active = self._active
+        return active[0] if active else None
+
+    def _build(self, version):
+        """Load and warm up a version so the first real request does not pay for it"""
+        start = time.time()
+        path = self.registry.path(version)
+        new_model = self.loader(path)
+        new_model.warmup()
+        logger.info(f"Model version {version} loaded and warmed up in {time.time() - start:.2f}s")
+        return new_model, path
+
+    def _wanted(self, role):
+        """Version the manifest currently wants in a role"""
+        manifest = self.registry.read()
+        if role == "active":
+            return manifest.get("active")
+        rollout = manifest.get("rollout")
+        return rollout["version"] if rollout else None
+
+    def _load(self, version, role):
+        try:
+            current = self._active
+            if current and current[0] == version:
+                new_model, path = current[1], self.registry.path(version)
+            else:
+                new_model, path = self._build(version)
+
+            # A slow load can finish after the manifest moved on; never swap in a stale version
+            with self._lock:
+                wanted = self._wanted(role)
+                if wanted != version:
+                    logger.info(f"Discarding loaded {role} version {version}; manifest now wants {wanted}")
+                    return
+
+                if role == "active":
+                    self._active = (version, new_model)
+                    if self.on_swap:
+                        self.on_swap(version, new_model, path)
+                    logger.info(f"Swapped active model to version {version}")
+                else:
+                    self._candidate = (version, new_model)
+                    logger.info(f"Rollout candidate {version} ready")
+        except Exception as e:
+            logger.error(f"Error loading model version {version}: {e}")
+        finally:
+            with self._lock:
+                self._loading.discard((role, version))
+
+    def _schedule(self, version, role, background):
+        with self._lock:
+            if (role, version) in self._loading:
+                return
+            self._loading.add((role, version))
+
+        if background:
+            threading.Thread(target=self._load, args=(version, role), daemon=True).start()
+        else:
+            self._load(version, role)
+
+    def sync(self, background=True):
+        """Load whatever the manifest says should be active or rolled out"""
+        manifest = self.registry.read()
+
+        active = manifest.get("active")
+        if active and active != self.active_version:
+            self._schedule(active, "active", background)
+
+        rollout = manifest.get("rollout")
+        if not rollout:
+            self._candidate = None
+            self._rollout = None
+            return
+
+        self._rollout = rollout
+        candidate = self._candidate
+        if not candidate or candidate[0] != rollout["version"]:
+            self._schedule(rollout["version"], "candidate", background)
+
+    def watch(self, interval=WATCH_INTERVAL):
+        """Poll the manifest and sync on change, so edits to registry.json roll out on their own"""
+        if interval <= 0:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                mtime = self.registry.mtime()
+                if mtime != self._watch_mtime:
+                    self._watch_mtime = mtime
+                    try:
+                        self.sync()
+                    except Exception as e:
+                        logger.error(f"Error syncing model registry: {e}")
+
+        self._watch_mtime = self.registry.mtime()
+        threading.Thread(target=loop, daemon=True, name="registry-watch").start()
+        logger.info(f"Watching {self.registry.manifest_path} every {interval}s")
+
+    def select(self):
+        """
+        Pick the model for one request.
+        Returns (version, model, shadow) where shadow is a (version, model) pair
+        to run in the background for comparison, or None.
+        """
+        active = self._active
+        candidate = self._candidate
+        rollout = self._rollout
+
+        if active is None:
+            return None, None, None
+        if not candidate or not rollout or candidate[0] != rollout["version"]:
+            return active[0], active[1], None
+
+        if rollout["mode"] == "canary":
+            if random.random() < rollout["fraction"]:
+                return candidate[0], candidate[1], None
+            return active[0], active[1], None
+
+        if random.random() < rollout["fraction"]:
+            return active[0], active[1], candidate
+        return active[0], active[1], None
+
+    def run_shadow(self, shadow, detect_fn, image, primary_detections, **options):
+        """
+        Run the shadow model off the request path with the primary's options;
+        skipped if the previous shadow run is still busy. A failed shadow run
+        counts as an error, not as disagreement.
+        """
+        if not self._shadow_busy.acquire(blocking=False):
+            self.stats.shadow_skipped += 1
+            return
+
+        version, shadow_model = shadow
+
+        def job():
+            try:
+                start = time.time()
+                result = detect_fn(image, shadow_model, **options)
+                if "error" in result:
+                    self.stats.shadow_errors += 1
+                    return
+                self.stats.record_latency(version, time.time() - start)
+                self.stats.record_agreement(version, detection_agreement(primary_detections, result["detections"]))
+            except Exception as e:
+                logger.error(f"Error in shadow inference for {version}: {e}")
+            finally:
+                self._shadow_busy.release()
+
+        self._shadow_pool.submit(job)
+
+    def status(self):
+        manifest = self.registry.read()
+        candidate = self._candidate
+        return {
+            "active": self.active_version,
+            "candidate": candidate[0] if candidate else None,
+            "rollout": manifest.get("rollout"),
+            "loading": sorted(f"{role}:{version}" for role, version in self._loading),
+            "versions": manifest.get("versions", {}),
+            "stats": self.stats.summary(),
+        }
@@ -0,0 +1,187 @@
+"""
+Runtime Tuning for CPU-only Containers
+DDS70 Project - match torch / OpenMP / OpenCV threads to the container's CPU quota
+
+Default thread pools size themselves to the host's cores, not the container's
+cgroup quota, so torch plus OpenCV end up oversubscribing the CPU.
+apply_runtime_tuning() reads the cgroup limits and gives the quota to torch,
+which runs one inference at a time per model; it must run before torch is
+imported. calibrate() optionally benchmarks a few thread counts on the
+loaded model and keeps the fastest.
+"""
+
+import ctypes
+import logging
+import math
+import os
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+RUNTIME_CALIBRATE = os.environ.get("RUNTIME_CALIBRATE", "0") == "1"
+CALIBRATION_RUNS = 5
+
+# glibc mallopt parameters
+M_TRIM_THRESHOLD = -1
+M_ARENA_MAX = -8
+
+MALLOC_ARENA_MAX = int(os.environ.get("MALLOC_ARENA_MAX", "2"))
+MALLOC_TRIM_THRESHOLD = 64 * 1024 * 1024
+
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+# Settings applied so far, reported on /health
+runtime_settings = {}
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def cgroup_cpu_limit():
+    """CPU quota in cores from cgroup v2 or v1, or None if unlimited"""
+    cpu_max = _read("/sys/fs/cgroup/cpu.max")
+    if cpu_max:
+        quota, _, period = cpu_max.partition(" ")
+        if quota != "max":
+            return int(quota) / int(period or 100000)
+        return None
+
+    quota = _read("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+    period = _read("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+    if quota and period and int(quota) > 0:
+        return int(quota) / int(period)
+    return None
+
+
+def cgroup_memory_limit():
+    """Memory limit in bytes from cgroup v2 or v1, or None if unlimited"""
+    limit = _read("/sys/fs/cgroup/memory.max") or _read("/sys/fs/cgroup/memory/memory.limit_in_bytes")
+    if not limit or limit == "max":
+        return None
+    limit = int(limit)
+    # cgroup v1 reports "unlimited" as a huge page-aligned number
+    return limit if limit < 1 << 60 else None
+
+
+def available_cpus():
+    """Cores this process may actually use: CPU affinity capped by the cgroup quota"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    quota = cgroup_cpu_limit()
+    if quota is not None:
+        cpus = min(cpus, max(1, math.ceil(quota)))
+    return cpus
+
+
+def _limit_malloc_arenas():
+    """Cap glibc arenas so per-thread allocator caches do not grow RSS past the memory limit"""
+    try:
+        libc = ctypes.CDLL("libc.so.6")
+        libc.mallopt(M_ARENA_MAX, MALLOC_ARENA_MAX)
+        libc.mallopt(M_TRIM_THRESHOLD, MALLOC_TRIM_THRESHOLD)
+        return True
+    except (OSError, AttributeError):
+        return False
+
+
+def apply_runtime_tuning():
+    """
+    Size thread pools to the container and cap allocator caching.
+    Call before torch is imported; thread variables already set in the
+    environment are left as they are.
+    """
+    cpus = available_cpus()
+    memory = cgroup_memory_limit()
+
+    for name in THREAD_ENV_VARS:
+        os.environ.setdefault(name, str(cpus))
+
+    runtime_settings.update({
+        "cpus": cpus,
+        "cgroup_cpu_quota": cgroup_cpu_limit(),
+        "cgroup_memory_limit_mb": round(memory / 2**20) if memory else None,
+        "omp_num_threads": int(os.environ["OMP_NUM_THREADS"]),
+        "malloc_arena_max": MALLOC_ARENA_MAX if _limit_malloc_arenas() else None,
+    })
+
+    try:
+        import cv2
+        # OpenCV only does pre/post-processing here; its own pool just competes with torch
+        cv2.setNumThreads(1)
+        runtime_settings["opencv_threads"] = 1
+    except ImportError:
+        pass
+
+    try:
+        import torch
+        torch.set_num_threads(int(os.environ["OMP_NUM_THREADS"]))
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            # Only allowed once, before any inter-op work has started
+            pass
+        runtime_settings.update({
+            "torch_threads": torch.get_num_threads(),
+            "torch_interop_threads": torch.get_num_interop_threads(),
+        })
+    except ImportError:
+        pass
+
+    if memory and memory < 1 << 30:
+        logger.warning(f"Container memory limit is only {memory / 2**20:.0f} MB; consider raising it")
+
+    logger.info(f"Runtime tuning: {runtime_settings}")
+    return runtime_settings
+
+
+def _benchmark(detector, frame):
+    timings = []
+    for _ in range(CALIBRATION_RUNS):
+        start = time.perf_counter()
+        detector.predict(frame)
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings))
+
+
+def calibrate(detector):
+    """
+    Micro-benchmark a few intra-op thread counts, with and without channels-last
+    weights, and keep the fastest combination for this container.
+    Candidates stay within the CPU quota, since inference on the model is
+    serialised and each request gets the whole quota.
+    """
+    import torch
+
+    cpus = available_cpus()
+    candidates = sorted({1, max(1, cpus // 2), cpus})
+    frame = np.zeros((640, 640, 3), dtype=np.uint8)
+    detector.warmup()
+
+    results = {}
+    for channels_last in (False, True):
+        detector.set_memory_format(channels_last)
+        for threads in candidates:
+            torch.set_num_threads(threads)
+            results[(threads, channels_last)] = _benchmark(detector, frame)
+
+    (threads, channels_last), best = min(results.items(), key=lambda item: item[1])
+    torch.set_num_threads(threads)
+    detector.set_memory_format(channels_last)
+
+    runtime_settings.update({
+        "torch_threads": threads,
+        "channels_last": channels_last,
+        "calibration_ms": {f"{t}t{'/cl' if cl else ''}": round(v * 1000, 1) for (t, cl), v in results.items()},
+    })
+    logger.info(f"Calibrated: {threads} threads, channels_last={channels_last}, {best * 1000:.1f} ms/frame")
+    return threads, channels_last
@@ -0,0 +1,340 @@
+"""
+Per-Player Shooting Statistics
+DDS70 Project - does Darren shoot less than 70%?
+
+Turns per-frame detections into shot attempts and makes credited to tracked
+players. A "shoot" detection that appears after a quiet gap starts an attempt
+by the nearest person; a "made" detection shortly after resolves that attempt
+as a make. Each event updates the player's running counters and rolling-window
+FG% in O(1), and the precomputed snapshot is what /api/stats serves.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from inference import box_iou
+
+logger = logging.getLogger(__name__)
+
+# FG% the project is asking about
+TARGET_FG = 0.70
+
+# Attempts kept in each player's rolling window
+ROLLING_WINDOW = 20
+
+# Frames without a shoot/made detection before a new one counts as a new event
+EVENT_COOLDOWN_FRAMES = 15
+
+# A make within this many seconds of an attempt is credited to that attempt
+MADE_WINDOW = 3.0
+
+# Minimum IoU to keep a person's id between frames when the model does not track
+TRACK_IOU = 0.3
+TRACK_MAX_AGE = 30
+
+UNKNOWN_PLAYER = -1
+
+
+class SimpleTracker:
+    """
+    Greedy IoU tracker for person boxes, used when detections come from
+    model.predict() rather than model.track() and carry no track ids.
+    """
+
+    def __init__(self, iou_threshold=TRACK_IOU, max_age=TRACK_MAX_AGE):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.boxes = np.zeros((0, 4), dtype=np.float32)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.last_seen = np.zeros(0, dtype=np.int64)
+        self.next_id = 1
+
+    def update(self, frame, boxes):
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        assigned = np.full(len(boxes), UNKNOWN_PLAYER, dtype=np.int64)
+
+        if len(boxes) and len(self.boxes):
+            iou = box_iou(boxes, self.boxes)
+            while True:
+                i, j = np.unravel_index(iou.argmax(), iou.shape)
+                if iou[i, j] < self.iou_threshold:
+                    break
+                assigned[i] = self.ids[j]
+                self.boxes[j] = boxes[i]
+                self.last_seen[j] = frame
+                iou[i, :] = 0
+                iou[:, j] = 0
+
+        new = assigned == UNKNOWN_PLAYER
+        if new.any():
+            new_ids = np.arange(self.next_id, self.next_id + new.sum())
+            self.next_id += int(new.sum())
+            assigned[new] = new_ids
+            self.boxes = np.concatenate([self.boxes, boxes[new]])
+            self.ids = np.concatenate([self.ids, new_ids])
+            self.last_seen = np.concatenate([self.last_seen, np.full(len(new_ids), frame)])
+
+        alive = frame - self.last_seen <= self.max_age
+        self.boxes, self.ids, self.last_seen = self.boxes[alive], self.ids[alive], self.last_seen[alive]
+        return assigned
+
+
+class PlayerStats:
+    """Running totals plus a rolling window of the last ROLLING_WINDOW attempts"""
+
+    __slots__ = ("player_id", "attempts", "makes", "recent", "recent_makes", "last_event_at")
+
+    def __init__(self, player_id, window=ROLLING_WINDOW):
+        self.player_id = player_id
+        self.attempts = 0
+        self.makes = 0
+        self.recent = deque(maxlen=window)
+        self.recent_makes = 0
+        self.last_event_at = None
+
+    def add_attempt(self, timestamp):
+        if len(self.recent) == self.recent.maxlen:
+            self.recent_makes -= self.recent[0]
+        self.recent.append(False)
+        self.attempts += 1
+        self.last_event_at = timestamp
+
+    def resolve_last_as_make(self, timestamp):
+        """Flip the player's latest attempt to a make"""
+        if not self.recent or self.recent[-1]:
+            return False
+        self.recent[-1] = True
+        self.recent_makes += 1
+        self.makes += 1
+        self.last_event_at = timestamp
+        return True
+
+    def to_dict(self):
+        fg = self.makes / self.attempts if self.attempts else None
+        rolling = self.recent_makes / len(self.recent) if self.recent else None
+        return {
+            "player_id": self.player_id,
+            "attempts": self.attempts,
+            "makes": self.makes,
+            "fg_pct": round(fg, 4) if fg is not None else None,
+            "rolling_fg_pct": round(rolling, 4) if rolling is not None else None,
+            "rolling_attempts": len(self.recent),
+            f"under_{int(TARGET_FG * 100)}": fg < TARGET_FG if fg is not None else None,
+            "last_event_at": self.last_event_at,
+        }
+
+
+class ShootingStatsAggregator:
+    """
+    Streaming shot attribution and per-player aggregates for one session.
+
+    process_frame() is called once per frame in order; snapshot() returns the
+    precomputed aggregates and wait_for_update() lets streaming clients block
+    until the next change.
+    """
+
+    def __init__(self, names, on_event=None):
+        ids = {name: class_id for class_id, name in dict(names).items()}
+        self.person_id = ids.get("person")
+        self.shoot_id = ids.get("shoot")
+        self.made_id = ids.get("made")
+        self.on_event = on_event
+
+        self.tracker = SimpleTracker()
+        self.players = {}
+        self.totals = {"attempts": 0, "makes": 0}
+        self.last_shoot_frame = None
+        self.last_made_frame = None
+        self.pending_attempt = None  # (player_id, timestamp)
+
+        self.version = 0
+        self.updated_at = None
+        self._player_view = {}
+        self._dirty = set()
+        self._changed = threading.Condition()
+        self._process_lock = threading.Lock()
+
+    def _player(self, player_id):
+        stats = self.players.get(player_id)
+        if stats is None:
+            stats = self.players[player_id] = PlayerStats(player_id)
+        self._dirty.add(player_id)
+        return stats
+
+    @staticmethod
+    def _nearest(point, person_boxes, person_ids):
+        """Track id of the person box whose centre is closest to point"""
+        if not len(person_ids):
+            return UNKNOWN_PLAYER
+        centres = (person_boxes[:, :2] + person_boxes[:, 2:]) / 2
+        return int(person_ids[np.argmin(((centres - point) ** 2).sum(axis=1))])
+
+    def assign_track_ids(self, frame, boxes, class_ids):
+        """
+        Track ids for one frame from the person tracker, UNKNOWN_PLAYER for
+        other classes. Pass the result to process_frame() for the same frame.
+        """
+        with self._process_lock:
+            boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+            class_ids = np.asarray(class_ids, dtype=np.int64).reshape(-1)
+            track_ids = np.full(len(class_ids), UNKNOWN_PLAYER, dtype=np.int64)
+            is_person = class_ids == self.person_id
+            track_ids[is_person] = self.tracker.update(frame, boxes[is_person])
+            return track_ids
+
+    def process_frame(self, frame, timestamp, boxes, class_ids, track_ids=None):
+        """Consume one frame of detections (xyxy boxes, class ids, optional track ids)"""
+        with self._process_lock:
+            self._process_frame(frame, timestamp, boxes, class_ids, track_ids)
+
+    def _process_frame(self, frame, timestamp, boxes, class_ids, track_ids):
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        class_ids = np.asarray(class_ids, dtype=np.int64).reshape(-1)
+
+        is_person = class_ids == self.person_id
+        person_boxes = boxes[is_person]
+        if track_ids is not None and np.all(np.asarray(track_ids)[is_person] >= 0):
+            person_ids = np.asarray(track_ids, dtype=np.int64)[is_person]
+        else:
+            person_ids = self.tracker.update(frame, person_boxes)
+
+        changed = False
+
+        shoot = class_ids == self.shoot_id
+        if shoot.any():
+            if self.last_shoot_frame is None or frame - self.last_shoot_frame > EVENT_COOLDOWN_FRAMES:
+                box = boxes[shoot][0]
+                point = (box[:2] + box[2:]) / 2
+                player_id = self._nearest(point, person_boxes, person_ids)
+                self._record_attempt(player_id, frame, timestamp, point)
+                changed = True
+            self.last_shoot_frame = frame
+
+        made = class_ids == self.made_id
+        if made.any():
+            if self.last_made_frame is None or frame - self.last_made_frame > EVENT_COOLDOWN_FRAMES:
+                box = boxes[made][0]
+                point = (box[:2] + box[2:]) / 2
+                self._record_make(frame, timestamp, point, person_boxes, person_ids)
+                changed = True
+            self.last_made_frame = frame
+
+        if changed:
+            self._publish()
+
+    def _record_attempt(self, player_id, frame, timestamp, point):
+        self._player(player_id).add_attempt(timestamp)
+        self.totals["attempts"] += 1
+        self.pending_attempt = (player_id, timestamp)
+        self._emit("shot", frame, timestamp, player_id, point)
+
+    def _record_make(self, frame, timestamp, point, person_boxes, person_ids):
+        pending = self.pending_attempt
+        if pending and timestamp - pending[1] <= MADE_WINDOW:
+            player_id = pending[0]
+        else:
+            # The attempt itself was missed by the detector; count both
+            player_id = self._nearest(point, person_boxes, person_ids)
+            self._record_attempt(player_id, frame, timestamp, point)
+
+        self.pending_attempt = None
+        if self._player(player_id).resolve_last_as_make(timestamp):
+            self.totals["makes"] += 1
+        self._emit("made", frame, timestamp, player_id, point)
+
+    def replay(self, events):
+        """
+        Rebuild the aggregates from stored (frame, timestamp, kind, player_id)
+        shot / made events, e.g. after a restart. Events are not re-emitted.
+        """
+        with self._process_lock:
+            replayed = 0
+            for frame, timestamp, kind, player_id in events:
+                if kind == "shot":
+                    self._player(player_id).add_attempt(timestamp)
+                    self.totals["attempts"] += 1
+                    self.pending_attempt = (player_id, timestamp)
+                    self.last_shoot_frame = frame
+                elif kind == "made":
+                    if self._player(player_id).resolve_last_as_make(timestamp):
+                        self.totals["makes"] += 1
+                    self.pending_attempt = None
+                    self.last_made_frame = frame
+                else:
+                    continue
+                replayed += 1
+                # New tracks must not reuse the ids of replayed players
+                self.tracker.next_id = max(self.tracker.next_id, player_id + 1)
+
+            if replayed:
+                self._publish()
+            return replayed
+
+    def _emit(self, kind, frame, timestamp, player_id, point):
+        if self.on_event:
+            try:
+                self.on_event(frame, timestamp, kind, player_id, tuple(int(v) for v in point))
+            except Exception as e:
+                logger.error(f"Error recording {kind} event: {e}")
+
+    def _publish(self):
+        """Refresh the precomputed entries of the players touched by this frame and wake streaming clients"""
+        with self._changed:
+            for player_id in self._dirty:
+                self._player_view[str(player_id)] = self.players[player_id].to_dict()
+            self._dirty.clear()
+            self.version += 1
+            self.updated_at = time.time()
+            self._changed.notify_all()
+
+    def _snapshot(self):
+        return {
+            "version": self.version,
+            "updated_at": self.updated_at,
+            "target_fg_pct": TARGET_FG,
+            "totals": dict(self.totals),
+            "players": dict(self._player_view),
+        }
+
+    def snapshot(self):
+        with self._changed:
+            return self._snapshot()
+
+    def wait_for_update(self, since_version, timeout=15.0):
+        """Block until the snapshot is newer than since_version; returns None on timeout"""
+        with self._changed:
+            if not self._changed.wait_for(lambda: self.version > since_version, timeout=timeout):
+                return None
+            return self._snapshot()
+
+
+_aggregators = {}
+_aggregators_lock = threading.Lock()
+
+
+def get_aggregator(session_id, names=None, on_event=None, history=None):
+    """
+    Aggregator for a session, created on first use when names are given.
+    history() may return the session's stored events, which are replayed
+    into a newly created aggregator.
+    """
+    with _aggregators_lock:
+        aggregator = _aggregators.get(session_id)
+        if aggregator is None and names is not None:
+            aggregator = ShootingStatsAggregator(names, on_event=on_event)
+            if history is not None:
+                try:
+                    aggregator.replay(history())
+                except Exception as e:
+                    logger.error(f"Error replaying stats for session {session_id}: {e}")
+            _aggregators[session_id] = aggregator
+        return aggregator
+
+
+def list_aggregators():
+    with _aggregators_lock:
+        return dict(_aggregators)